@@ -3,6 +3,9 @@ from models import User, Deck, Card, UserProgress, Language, Color
 from sqladmin.authentication import AuthenticationBackend
 from fastapi import Request
 from config import settings
+from database import AsyncSessionLocal
+from services import DeckService
+from auth import principal_cache
 
 
 class BasicAuthBackend(AuthenticationBackend):
@@ -29,19 +32,66 @@ class UserAdmin(ModelView, model=User):
     form_columns = [User.id, User.username, User.email, User.color, User.language]
     column_searchable_list = [User.username, User.email]
 
+    async def after_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        # the username may have changed, so the old key is unknown here
+        principal_cache.clear()
+
+    async def after_model_delete(self, model, request: Request) -> None:
+        principal_cache.clear()
+
 
 class DeckAdmin(ModelView, model=Deck):
     column_list = [Deck.id, Deck.name, Deck.user_id, Deck.owner]
     form_columns = [Deck.id, Deck.name, Deck.user_id, Deck.owner]
     column_searchable_list = [Deck.name, Deck.user_id]
 
+    async def on_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        if not is_created:
+            model.version = Deck.version + 1
+
+
+class DeckCountersMixin:
+    """Keeps decks.card_count and deck_progress in sync with edits made through the admin"""
+    async def on_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        # runs before the form is applied, so this is the deck a moved row leaves behind
+        request.state.previous_deck_id = None if is_created else model.deck_id
+
+    async def after_model_change(self, data: dict, model, is_created: bool, request: Request) -> None:
+        await self.rebuild_counters(request.state.previous_deck_id, model.deck_id)
 
-class CardAdmin(ModelView, model=Card):
+    async def after_model_delete(self, model, request: Request) -> None:
+        await self.rebuild_counters(model.deck_id)
+
+    @staticmethod
+    async def rebuild_counters(*deck_ids: int):
+        async with AsyncSessionLocal() as db:
+            for deck_id in {deck_id for deck_id in deck_ids if deck_id is not None}:
+                await DeckService.rebuild_counters(db, deck_id)
+            await db.commit()
+
+
+class CardAdmin(DeckCountersMixin, ModelView, model=Card):
     column_list = [Card.id, Card.entry, Card.value, Card.deck_id, Card.deck]
     form_columns = [Card.id, Card.entry, Card.value, Card.deck_id, Card.deck]
     column_searchable_list = [Card.entry, Card.value, Card.deck_id]
 
+    def search_query(self, stmt, term: str):
+        # sqladmin casts every searchable column to VARCHAR, which keeps entry/value off their trigram indexes
+        search = DeckService.card_search_filter(term)
+        if term.isdigit():
+            search = search | (Card.deck_id == int(term))
+        return stmt.where(search)
+
+    @staticmethod
+    async def rebuild_counters(*deck_ids: int):
+        async with AsyncSessionLocal() as db:
+            for deck_id in {deck_id for deck_id in deck_ids if deck_id is not None}:
+                await DeckService.rebuild_counters(db, deck_id)
+                # card edits change the deck listing, so its ETag has to move as well
+                await DeckService.bump_version(db, deck_id)
+            await db.commit()
+
 
-class UserProgressAdmin(ModelView, model=UserProgress):
+class UserProgressAdmin(DeckCountersMixin, ModelView, model=UserProgress):
     column_list = "__all__"
     form_columns = "__all__"
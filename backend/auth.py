@@ -1,24 +1,76 @@
+import asyncio
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import partial
 from jose import JWTError, jwt
 import bcrypt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
 from database import get_db
 from config import settings
+from cache import TTLCache
+from utils import APIException
 from typing import Optional
 
 
 security = HTTPBearer(auto_error=False)
 
 
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user as resolved from the access token"""
+    id: int
+    username: str
+    color: Optional[int]
+    language: Optional[int]
+
+
+# keyed by token subject, invalidated by UserService.update_user
+principal_cache = TTLCache(maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 
 def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=12)).decode('utf-8')
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    return int(hashed_password.split('$')[2]) != settings.BCRYPT_ROUNDS
+
+
+# bcrypt gets its own small pool so a burst of logins cannot take over the threadpool
+# shared by the rest of the app; once the queue is full requests are shed with a 503
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_pending = 0
+
+
+async def _run_hashing(func, *args):
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_QUEUE_LIMIT:
+        raise APIException(localization_key='error.server_busy', status_code=503)
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, partial(func, *args))
+    finally:
+        _hash_pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing(verify_password, plain_password, hashed_password)
 
 
 def create_access_token(data: dict) -> str:
@@ -39,8 +91,19 @@ def decode_refresh_token(token: str) -> dict:
     return jwt.decode(token, settings.REFRESH_SECRET_KEY, algorithms=[settings.ALGORITHM])
 
 
+async def get_principal(db: AsyncSession, username: str) -> Optional[Principal]:
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = await db.scalar(select(User).where(User.username == username))
+        if user is None:
+            return None
+        principal = Principal(id=user.id, username=user.username, color=user.color, language=user.language)
+        principal_cache.set(username, principal)
+    return principal
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security),
-                           db: Session = Depends(get_db)) -> User:
+                           db: AsyncSession = Depends(get_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,13 +116,13 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             raise credentials_exception
     except (JWTError, AttributeError):
         raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+    user = await get_principal(db, username)
     if user is None:
         raise credentials_exception
     return user
 
 async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-                            db: Session = Depends(get_db)) -> Optional[User]:
+                            db: AsyncSession = Depends(get_db)) -> Optional[Principal]:
     if credentials is None:
         return None
     try:
@@ -69,5 +132,20 @@ async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials]
             return None
     except JWTError:
         return None
-    user = db.query(User).filter(User.username == username).first()
-    return user
\ No newline at end of file
+    user = await get_principal(db, username)
+    return user
+
+
+async def require_metrics_access(request: Request,
+                                 credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> None:
+    """Metrics are for operators: an admin panel session or the METRICS_TOKEN bearer a scraper is given"""
+    if request.session.get("token") == "authenticated":
+        return
+    token = settings.METRICS_TOKEN
+    if token and credentials is not None and hmac.compare_digest(credentials.credentials.encode(), token.encode()):
+        return
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
@@ -0,0 +1,76 @@
+"""Setup shared by the benchmarks: throwaway users and seeded decks.
+
+Users live for one run only; deleting them takes their decks, cards, progress and
+study sessions with them through the foreign key cascades, also when a run fails.
+"""
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List
+from sqlalchemy import select, delete, insert
+from database import AsyncSessionLocal
+from models import User, Deck, Card, UserProgress
+from services import DeckService
+
+
+async def seed_deck(db, user: User, size: int) -> Deck:
+    deck = Deck(name=f"bench-{size}", user_id=user.id)
+    db.add(deck)
+    await db.flush()
+    await db.execute(insert(Card), [
+        {"deck_id": deck.id, "entry": f"entry {i}", "value": f"value {i}"} for i in range(size)
+    ])
+    card_ids = (await db.scalars(select(Card.id).where(Card.deck_id == deck.id).order_by(Card.id))).all()
+    # every other card is learned, every fourth one reviewed but not learned yet, the rest untouched;
+    # reviewed cards are scheduled from a week overdue to a week ahead
+    now = datetime.now(timezone.utc)
+    await db.execute(insert(UserProgress), [
+        {"user_id": user.id, "deck_id": deck.id, "card_id": card_id, "learned": i % 2 == 0,
+         "repetitions": 2, "interval_days": 6, "due_at": now + timedelta(days=i % 14 - 7)}
+        for i, card_id in enumerate(card_ids) if i % 4 != 3
+    ])
+    await DeckService.rebuild_counters(db, deck.id)
+    await db.commit()
+    await db.refresh(deck)
+    return deck
+
+
+async def delete_users(db, user_ids: List[int]):
+    # a failed statement leaves the session unusable until it is rolled back
+    await db.rollback()
+    await db.execute(delete(User).where(User.id.in_(user_ids)))
+    await db.commit()
+
+
+@asynccontextmanager
+async def throwaway_users(db, prefix: str, count: int = 1) -> AsyncIterator[List[User]]:
+    """`count` users created directly in the database, deleted when the block exits"""
+    stamp = time.time_ns()
+    users = [User(username=f"{prefix}-{stamp}-{i}", email=f"{prefix}-{stamp}-{i}@example.com")
+             for i in range(count)]
+    db.add_all(users)
+    await db.commit()
+    user_ids = [user.id for user in users]
+    try:
+        yield users
+    finally:
+        await delete_users(db, user_ids)
+
+
+@asynccontextmanager
+async def registered_user(client, prefix: str) -> AsyncIterator[tuple]:
+    """A user registered and logged in through the API; yields (user_id, auth headers) and
+    deletes the user when the block exits"""
+    username, password = f"{prefix}{time.time_ns()}", "benchmark"
+    response = await client.post("/api/auth/register", json={
+        "username": username, "email": f"{username}@example.com", "password": password
+    })
+    response.raise_for_status()
+    user_id = response.json()["user_id"]
+    try:
+        response = await client.post("/api/auth/login", json={"username": username, "password": password})
+        response.raise_for_status()
+        yield user_id, {"Authorization": f"Bearer {response.json()['access']}"}
+    finally:
+        async with AsyncSessionLocal() as db:
+            await delete_users(db, [user_id])
@@ -0,0 +1,70 @@
+"""Requests per second against a running API as the number of concurrent clients grows.
+
+    pip install httpx
+    python benchmarks/concurrency.py [BASE_URL]
+
+BASE_URL defaults to http://localhost:8000. A throwaway user with one 1000-card
+deck is registered, then every client loops over authenticated /api/auth/me and
+/next-card calls. With a blocking event loop the numbers flatline at one client's
+throughput; they should keep climbing until the database or the CPU saturates.
+"""
+import sys
+import time
+import asyncio
+import httpx
+
+
+CLIENTS = (1, 2, 4, 8, 16, 32, 64)
+DURATION = 5.0
+
+
+async def prepare(client: httpx.AsyncClient) -> tuple:
+    username = f"bench{time.time_ns()}"
+    password = "benchmark"
+    response = await client.post("/api/auth/register", json={
+        "username": username, "email": f"{username}@example.com", "password": password
+    })
+    response.raise_for_status()
+    response = await client.post("/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access']}"}
+    response = await client.post("/api/decks", json={"name": "benchmark"}, headers=headers)
+    response.raise_for_status()
+    deck_id = response.json()["id"]
+    cards = [{"entry": f"entry {i}", "value": f"value {i}"} for i in range(1000)]
+    response = await client.put(f"/api/decks/{deck_id}/cards", json={"cards": cards}, headers=headers)
+    response.raise_for_status()
+    return headers, deck_id
+
+
+async def worker(client: httpx.AsyncClient, headers: dict, deck_id: int, deadline: float) -> int:
+    response = await client.post(f"/api/decks/{deck_id}/sessions", json={"mode": "all"}, headers=headers)
+    session = response.json()["session"]
+    done = 1
+    while time.perf_counter() < deadline:
+        await client.get("/api/auth/me", headers=headers)
+        response = await client.post(f"/api/decks/{deck_id}/next-card", json={"session": session}, headers=headers)
+        if response.json()["card"] is None:
+            response = await client.post(f"/api/decks/{deck_id}/sessions", json={"mode": "all"}, headers=headers)
+        session = response.json()["session"]
+        done += 2
+    return done
+
+
+async def main(base_url: str):
+    limits = httpx.Limits(max_connections=max(CLIENTS))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        headers, deck_id = await prepare(client)
+        try:
+            print(f"{'clients':>8} {'req/s':>10}")
+            for clients in CLIENTS:
+                deadline = time.perf_counter() + DURATION
+                start = time.perf_counter()
+                done = await asyncio.gather(*(worker(client, headers, deck_id, deadline) for _ in range(clients)))
+                print(f"{clients:>8} {sum(done) / (time.perf_counter() - start):>10.1f}")
+        finally:
+            await client.delete(f"/api/decks/{deck_id}", headers=headers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"))
@@ -0,0 +1,116 @@
+"""Check that the hot DeckService queries are served by the composite indexes.
+
+Run from the backend directory against a throwaway, migrated database:
+
+    DATABASE_URL=postgresql://... python benchmarks/explain_indexes.py
+
+Seeds a few decks next to BACKGROUND_USERS other users' decks, runs EXPLAIN for every
+query shape and exits non-zero if a plan does not mention the index it is supposed to use.
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import select, text, delete, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from database import AsyncSessionLocal, async_engine
+from models import User, Card, UserProgress, StudyMode
+from services import DeckService
+from common import seed_deck, throwaway_users
+
+
+BACKGROUND_USERS = 50
+BACKGROUND_CARDS = 2_000
+
+
+async def explain(db, stmt) -> str:
+    sql = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    return "\n".join(row[0] for row in await db.execute(text(f"EXPLAIN {sql}")))
+
+
+async def main():
+    failed = False
+    async with AsyncSessionLocal() as db, throwaway_users(db, "explain", BACKGROUND_USERS + 1) as users:
+        # the checked user is one of many, as in production; alone in the tables every plan reads them whole
+        for other in users[1:]:
+            await seed_deck(db, other, BACKGROUND_CARDS)
+        failed = await check(db, users[0])
+    sys.exit(1 if failed else 0)
+
+
+async def check(db, user: User) -> bool:
+    decks = [await seed_deck(db, user, 5_000) for _ in range(4)]
+    deck = decks[0]
+    # autovacuum keeps the visibility map of live tables current, without it index-only scans look needlessly
+    # expensive on a freshly seeded one
+    async with async_engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("VACUUM ANALYZE cards"))
+        await connection.execute(text("VACUUM ANALYZE user_progress"))
+    card_id = await db.scalar(select(Card.id).where(Card.deck_id == deck.id).limit(1))
+    checks = {
+        "session start (unlearned)": (
+            DeckService._session_cards_statement(deck, user_id=user.id, mode=StudyMode.UNLEARNED.value),
+            ["ix_cards_deck_shuffle"]
+        ),
+        "session start (learned)": (
+            DeckService._session_cards_statement(deck, user_id=user.id, mode=StudyMode.LEARNED.value),
+            ["ix_user_progress_learned"]
+        ),
+        "session start (due)": (
+            DeckService._session_cards_statement(deck, user_id=user.id, mode=StudyMode.DUE.value),
+            ["ix_user_progress_due"]
+        ),
+        "session step (walk)": (
+            DeckService._walk_step("0" * 32, deck, user.id, func.coalesce(UserProgress.learned, False),
+                                   (0, 0, 0), 20),
+            ["ix_cards_deck_shuffle"]
+        ),
+        "due count": (
+            select(func.count()).select_from(UserProgress).where(
+                UserProgress.user_id == user.id,
+                UserProgress.deck_id == deck.id,
+                UserProgress.due_at <= func.now()
+            ),
+            ["ix_user_progress_due"]
+        ),
+        "new cards": (
+            DeckService._new_cards_statement(deck, user_id=user.id),
+            ["ix_cards_deck_id_id"]
+        ),
+        "progress upsert": (
+            insert(UserProgress).values(user_id=user.id, deck_id=deck.id, card_id=card_id, learned=True)
+            .on_conflict_do_update(
+                index_elements=[UserProgress.user_id, UserProgress.card_id],
+                set_={"learned": UserProgress.learned.isnot(True)}
+            ),
+            ["uq_user_progress_user_card"]
+        ),
+        "reset progress": (
+            delete(UserProgress).where(UserProgress.user_id == user.id, UserProgress.deck_id == deck.id),
+            ["ix_user_progress_due"]
+        ),
+        "deck cards": (
+            select(Card).where(Card.deck_id == deck.id),
+            ["ix_cards_deck_id_id"]
+        ),
+        "card search": (
+            # a rare term, the way most searches are; frequent ones may rightly scan the caller's decks
+            DeckService._search_cards_statement("value 1999", user_id=user.id, limit=21),
+            ["ix_cards_entry_trgm", "ix_cards_value_trgm"]
+        ),
+    }
+    failed = False
+    for name, (stmt, indexes) in checks.items():
+        plan = await explain(db, stmt)
+        missing = [index for index in indexes if index not in plan]
+        print(f"{'FAIL' if missing else 'ok':>4}  {name}")
+        if missing:
+            failed = True
+            print(f"      expected {', '.join(missing)} in:\n{plan}")
+    return failed
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""Latency and memory of listing a 50k-card deck.
+
+Run from the backend directory against a throwaway, migrated database:
+
+    DATABASE_URL=postgresql://... python benchmarks/list_cards.py
+
+Compares the old listing (every Card ORM object, serialized in Python) with the
+column-only keyset pages of DeckService.get_deck_cards: the first page alone and
+a walk over the whole deck. Memory is the tracemalloc peak of building the
+response payload.
+"""
+import sys
+import os
+import time
+import asyncio
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import Card
+from services import DeckService
+from common import seed_deck, throwaway_users
+
+
+SIZE = 50_000
+PAGE = 1000
+
+
+async def orm_listing(db, deck) -> int:
+    cards = (await db.scalars(select(Card).where(Card.deck_id == deck.id))).all()
+    payload = {"cards": [{"entry": card.entry, "value": card.value} for card in cards]}
+    db.expunge_all()
+    return len(payload["cards"])
+
+
+async def first_page(db, deck) -> int:
+    cards = await DeckService.get_deck_cards(db, deck, limit=PAGE)
+    payload = {"cards": [{"id": card.id, "entry": card.entry, "value": card.value} for card in cards]}
+    return len(payload["cards"])
+
+
+async def keyset_walk(db, deck) -> int:
+    total, after = 0, None
+    while True:
+        cards = await DeckService.get_deck_cards(db, deck, limit=PAGE, after=after)
+        if not cards:
+            return total
+        payload = {"cards": [{"id": card.id, "entry": card.entry, "value": card.value} for card in cards]}
+        total += len(payload["cards"])
+        after = cards[-1].id
+
+
+async def measure(db, deck, listing) -> tuple:
+    await listing(db, deck)
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = await listing(db, deck)
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak / 1024 / 1024
+
+
+async def main():
+    async with AsyncSessionLocal() as db, throwaway_users(db, "list") as (user,):
+        deck = await seed_deck(db, user, SIZE)
+        print(f"{'listing':>26} {'rows':>8} {'ms':>10} {'peak MiB':>10}")
+        for name, listing in (("ORM, whole deck (before)", orm_listing),
+                              (f"keyset, first {PAGE}", first_page),
+                              ("keyset, whole deck", keyset_walk)):
+            rows, elapsed, peak = await measure(db, deck, listing)
+            print(f"{name:>26} {rows:>8} {elapsed:>10.1f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""Next-card latency per deck size.
+
+Run from the backend directory against a throwaway, migrated database:
+
+    DATABASE_URL=postgresql://... python benchmarks/next_card.py
+
+Seeds one user with decks of 100 .. 100k cards (half of them learned, a quarter
+reviewed but not learned), times DeckService.start_session and
+DeckService.get_next_card for every study mode and removes the data afterwards.
+Neither time should depend on the deck size: due sessions and ones of at most
+SESSION_SNAPSHOT_LIMIT cards snapshot a bounded order, bigger ones store a random
+start key and every step reads ix_cards_deck_shuffle from the cursor on.
+"""
+import sys
+import os
+import time
+import asyncio
+import statistics
+from typing import Tuple
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import AsyncSessionLocal
+from models import User, Deck, StudyMode
+from services import DeckService
+from common import seed_deck, throwaway_users
+
+
+SIZES = (100, 1_000, 10_000, 100_000)
+ROUNDS = 50
+
+
+async def measure(db, user: User, deck: Deck, mode: str) -> Tuple[float, float]:
+    starts, nexts = [], []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        session = await DeckService.start_session(db, deck, user.id, mode)
+        starts.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        _, _, session = await DeckService.get_next_card(db, user.id, deck, session)
+        nexts.append((time.perf_counter() - start) * 1000)
+    return statistics.median(starts), statistics.median(nexts)
+
+
+async def main():
+    async with AsyncSessionLocal() as db, throwaway_users(db, "bench") as (user,):
+        print(f"{'cards':>8} " + " ".join(f"{mode.value + ' start/next':>24}" for mode in StudyMode))
+        for size in SIZES:
+            deck = await seed_deck(db, user, size)
+            row = [await measure(db, user, deck, mode.value) for mode in StudyMode]
+            print(f"{size:>8} " + " ".join(f"{start:>13.2f}/{next_:.2f}ms".rjust(24) for start, next_ in row))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+"""Endpoint regression suite: SQL statement, latency and memory budgets per deck size.
+
+Run from the backend directory against a throwaway, migrated Postgres database:
+
+    pip install httpx
+    DATABASE_URL=postgresql://... python benchmarks/regression.py [--report report.json] [--baseline old.json]
+
+Drives main.app in-process over httpx for decks of every size in SIZES (half of the
+cards learned and scheduled), and checks each endpoint against benchmarks/budgets.json:
+
+- statements: SQL statements one request sends, auth included (the principal cache is warm),
+  the same for every deck size except for import, which writes one more batch per
+  IMPORT_BATCH_SIZE rows (it uploads as many rows as the deck has cards);
+- ms: median latency over ROUNDS requests;
+- peak_mib: tracemalloc peak of a single request.
+
+The queries use Postgres-only SQL (unnest, array slices, ON CONFLICT), so SQLite cannot
+stand in. The report is plain JSON keyed by endpoint and deck size; with --baseline the
+run is compared to an earlier report, and any endpoint that sends more statements than
+before fails too. A due session on a deck nobody has reviewed yet must not come back
+empty. Exits non-zero on any failure.
+"""
+import sys
+import os
+import json
+import math
+import time
+import asyncio
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpx
+from sqlalchemy import event, text
+from database import AsyncSessionLocal, async_engine
+from models import User
+from main import app
+from services import IMPORT_BATCH_SIZE
+from common import seed_deck, registered_user
+
+
+SIZES = (100, 1_000, 10_000)
+ROUNDS = 20
+BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budgets.json")
+statements = 0
+
+
+def count_statement(*args):
+    global statements
+    statements += 1
+
+
+class Scenario:
+    """One endpoint against one deck; prepare runs unmeasured, call is the measured request."""
+
+    def __init__(self, client: httpx.AsyncClient, headers: dict, deck_id: int, size: int):
+        self.client = client
+        self.headers = headers
+        self.deck_id = deck_id
+        self.size = size
+        self.session = None
+        self.card_id = None
+        self.upload = None
+
+    async def prepare(self):
+        response = await self.client.post(f"/api/decks/{self.deck_id}/sessions",
+                                          json={"mode": "unlearned"}, headers=self.headers)
+        self.session = response.json()["session"]
+        response = await self.client.get(f"/api/decks/{self.deck_id}/cards?limit=1", headers=self.headers)
+        self.card_id = response.json()["cards"][0]["id"]
+        # as many rows as the deck has cards, so the import scales with the size under test
+        rows = "".join(f"import {i},value {i}\n" for i in range(self.size))
+        self.upload = f"entry,value\n{rows}".encode()
+
+    async def call(self, name: str) -> httpx.Response:
+        url = f"/api/decks/{self.deck_id}"
+        if name == "start_session":
+            return await self.client.post(f"{url}/sessions", json={"mode": "unlearned"}, headers=self.headers)
+        if name in ("next_card", "next_cards"):
+            body = {"session": self.session} if name == "next_card" else {"session": self.session, "count": 50}
+            response = await self.client.post(f"{url}/{name.replace('_', '-')}", json=body, headers=self.headers)
+            self.session = response.json()["session"]
+            return response
+        if name == "toggle_learned":
+            return await self.client.patch(f"{url}/toggle_learned", json={"card_id": self.card_id},
+                                           headers=self.headers)
+        if name == "deck_cards":
+            return await self.client.get(f"{url}/cards?limit=1000", headers=self.headers)
+        if name == "export":
+            # the body is streamed, reading it is part of the request
+            return await self.client.get(f"{url}/export?format=csv", headers=self.headers)
+        if name == "import":
+            files = {"file": ("cards.csv", self.upload, "text/csv")}
+            return await self.client.post(f"{url}/import", files=files, headers=self.headers)
+        raise ValueError(name)
+
+
+async def measure(scenario: Scenario, name: str) -> dict:
+    global statements
+    await scenario.prepare()
+    (await scenario.call(name)).raise_for_status()
+    latencies, counts = [], []
+    for _ in range(ROUNDS):
+        statements = 0
+        start = time.perf_counter()
+        response = await scenario.call(name)
+        latencies.append((time.perf_counter() - start) * 1000)
+        counts.append(statements)
+        response.raise_for_status()
+    tracemalloc.start()
+    await scenario.call(name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "statements": max(counts),
+        "median_ms": round(statistics.median(latencies), 2),
+        "max_ms": round(max(latencies), 2),
+        "peak_mib": round(peak / 1024 / 1024, 2)
+    }
+
+
+async def check_due_session(client: httpx.AsyncClient, headers: dict) -> list:
+    """A deck nobody has reviewed yet still has cards to study in due mode"""
+    response = await client.post("/api/decks", json={"name": "regression due"}, headers=headers)
+    response.raise_for_status()
+    deck_id = response.json()["id"]
+    try:
+        cards = [{"entry": f"entry {i}", "value": f"value {i}"} for i in range(10)]
+        (await client.put(f"/api/decks/{deck_id}/cards", json={"cards": cards}, headers=headers)).raise_for_status()
+        response = await client.post(f"/api/decks/{deck_id}/sessions", json={"mode": "due"}, headers=headers)
+        response = await client.post(f"/api/decks/{deck_id}/next-card", json={"session": response.json()["session"]},
+                                     headers=headers)
+        response.raise_for_status()
+        return [] if response.json()["card"] else ["due session: empty on a fresh deck"]
+    finally:
+        await client.delete(f"/api/decks/{deck_id}", headers=headers)
+
+
+def check(name: str, size: int, result: dict, budget: dict, baseline: dict) -> list:
+    failures = []
+    statements = budget["statements"]
+    if name == "import":
+        # one upsert per IMPORT_BATCH_SIZE rows, the budget covers the first
+        statements += math.ceil(size / IMPORT_BATCH_SIZE) - 1
+    if result["statements"] > statements:
+        failures.append(f"{name}@{size}: {result['statements']} statements, budget {statements}")
+    if result["median_ms"] > budget["ms"]:
+        failures.append(f"{name}@{size}: median {result['median_ms']} ms, budget {budget['ms']} ms")
+    if result["peak_mib"] > budget["peak_mib"]:
+        failures.append(f"{name}@{size}: peak {result['peak_mib']} MiB, budget {budget['peak_mib']} MiB")
+    before = baseline.get(name, {}).get(str(size))
+    if before and result["statements"] > before["statements"]:
+        failures.append(f"{name}@{size}: {result['statements']} statements, baseline {before['statements']}")
+    return failures
+
+
+async def main(report_path: str, baseline_path: str):
+    with open(BUDGETS) as file:
+        budgets = json.load(file)
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)["results"]
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    transport = httpx.ASGITransport(app=app)
+    results, failures = {name: {} for name in budgets}, []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async with registered_user(client, "regression") as (user_id, headers), AsyncSessionLocal() as db:
+            failures += await check_due_session(client, headers)
+            user = await db.get(User, user_id)
+            print(f"{'endpoint':>16} {'cards':>7} {'stmts':>6} {'median ms':>10} {'max ms':>9} "
+                  f"{'peak MiB':>9} {'baseline ms':>12}")
+            for size in SIZES:
+                deck = await seed_deck(db, user, size)
+                # fresh rows have no planner statistics yet, which production tables always have
+                await db.execute(text("ANALYZE cards, user_progress"))
+                # import replaces the deck's cards and with them the progress, so it goes last
+                for name in budgets:
+                    result = await measure(Scenario(client, headers, deck.id, size), name)
+                    results[name][str(size)] = result
+                    failures += check(name, size, result, budgets[name], baseline)
+                    before = baseline.get(name, {}).get(str(size), {}).get("median_ms", "-")
+                    print(f"{name:>16} {size:>7} {result['statements']:>6} {result['median_ms']:>10.2f} "
+                          f"{result['max_ms']:>9.2f} {result['peak_mib']:>9.2f} {before:>12}")
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "sizes": list(SIZES),
+        "rounds": ROUNDS,
+        "results": results,
+        "failures": failures
+    }
+    if report_path:
+        with open(report_path, "w") as file:
+            json.dump(report, file, indent=2)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Endpoint performance regression suite")
+    parser.add_argument("--report", help="write the JSON report to this path")
+    parser.add_argument("--baseline", help="an earlier JSON report to compare with")
+    arguments = parser.parse_args()
+    sys.exit(asyncio.run(main(arguments.report, arguments.baseline)))
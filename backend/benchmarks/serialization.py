@@ -0,0 +1,76 @@
+"""Cost of turning large deck payloads into response bytes.
+
+No database needed, run from the backend directory:
+
+    python benchmarks/serialization.py
+
+Renders payloads shaped like the deck routes' responses the way FastAPI does it:
+before, without response models, through jsonable_encoder and the stdlib JSONResponse;
+after, through the route's response model and ORJSONResponse. Both must produce the
+same bytes, so clients see no difference on the wire.
+"""
+import sys
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from schemas import deck as deck_schema
+
+
+SIZE = 50_000
+ROUNDS = 5
+
+
+def payloads() -> list:
+    now = datetime.now(timezone.utc)
+    cards = [{"id": i, "entry": f"entry {i} — ünïcode", "value": f"value {i}"} for i in range(SIZE)]
+    study = [dict(card, learned=i % 2 == 0) for i, card in enumerate(cards[:100])]
+    return [
+        (f"card page ({len(cards[:5000])})", deck_schema.CardPageResponse,
+         {"cards": cards[:5000], "next_cursor": 4999}),
+        (f"saved cards ({SIZE})", deck_schema.CardsResponse,
+         {"cards": [{"entry": card["entry"], "value": card["value"]} for card in cards]}),
+        (f"next-cards ({len(study)})", deck_schema.NextCardsResponse,
+         {"cards": study, "stats": {"total": SIZE, "learned": 50, "remain": SIZE - 100}, "session": "f" * 32 + ":100"}),
+        ("reviews (10000)", deck_schema.ReviewsResponse,
+         {"cards": [{"card_id": i, "interval_days": i % 30, "due_at": now + timedelta(days=i % 30)}
+                    for i in range(10_000)],
+          "stats": {"total": SIZE, "learned": 10_000, "due": 0}}),
+    ]
+
+
+async def before(model, content) -> bytes:
+    return JSONResponse(content=jsonable_encoder(content)).body
+
+
+async def after(model, content) -> bytes:
+    field = create_model_field(name="Response", type_=model, mode="serialization")
+    return ORJSONResponse(content=await serialize_response(
+        field=field, response_content=content, exclude_unset=True
+    )).body
+
+
+async def measure(render, model, content) -> tuple:
+    body = await render(model, content)
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await render(model, content)
+    return body, (time.perf_counter() - start) * 1000 / ROUNDS
+
+
+async def main():
+    print(f"{'payload':>22} {'KiB':>8} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for name, model, content in payloads():
+        expected, slow = await measure(before, model, content)
+        body, fast = await measure(after, model, content)
+        assert body == expected, f"{name}: response bytes differ"
+        print(f"{name:>22} {len(body) / 1024:>8.0f} {slow:>10.1f} {fast:>10.1f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""Requests and SQL statements per study session: next-card vs next-cards.
+
+Run from the backend directory against a throwaway, migrated database:
+
+    pip install httpx
+    DATABASE_URL=postgresql://... python benchmarks/study_session.py
+
+Drives the app in-process, walks a whole deck once per endpoint and counts the
+HTTP requests, the statements the API sent to the database (auth included) and
+the largest request body, which stays constant with session tokens.
+"""
+import sys
+import os
+import time
+import asyncio
+from typing import Tuple
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpx
+from sqlalchemy import event
+from database import async_engine
+from main import app
+from common import registered_user
+
+
+SIZE = 500
+BATCH = 50
+statements = 0
+
+
+def count_statement(*args):
+    global statements
+    statements += 1
+
+
+async def new_deck(client: httpx.AsyncClient, headers: dict) -> int:
+    response = await client.post("/api/decks", json={"name": "session"}, headers=headers)
+    response.raise_for_status()
+    deck_id = response.json()["id"]
+    cards = [{"entry": f"entry {i}", "value": f"value {i}"} for i in range(SIZE)]
+    response = await client.put(f"/api/decks/{deck_id}/cards", json={"cards": cards}, headers=headers)
+    response.raise_for_status()
+    return deck_id
+
+
+async def walk(client: httpx.AsyncClient, headers: dict, deck_id: int, count: int) -> Tuple[int, int]:
+    response = await client.post(f"/api/decks/{deck_id}/sessions", json={"mode": "all"}, headers=headers)
+    session = response.json()["session"]
+    requests, sent = 1, 0
+    while True:
+        if count == 1:
+            response = await client.post(f"/api/decks/{deck_id}/next-card",
+                                         json={"session": session}, headers=headers)
+        else:
+            response = await client.post(f"/api/decks/{deck_id}/next-cards",
+                                         json={"session": session, "count": count}, headers=headers)
+        requests += 1
+        sent = max(sent, len(response.request.content))
+        data = response.json()
+        session = data["session"]
+        if not (data["cards"] if count > 1 else data["card"]):
+            return requests, sent
+
+
+async def main():
+    global statements
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async with registered_user(client, "session") as (_, headers):
+            print(f"{SIZE}-card session")
+            print(f"{'endpoint':>24} {'requests':>10} {'statements':>12} {'max body':>10} {'seconds':>10}")
+            for name, count in (("next-card", 1), (f"next-cards (count={BATCH})", BATCH)):
+                deck_id = await new_deck(client, headers)
+                try:
+                    statements = 0
+                    start = time.perf_counter()
+                    requests, sent = await walk(client, headers, deck_id, count)
+                    elapsed = time.perf_counter() - start
+                    print(f"{name:>24} {requests:>10} {statements:>12} {sent:>9}B {elapsed:>10.2f}")
+                finally:
+                    await client.delete(f"/api/decks/{deck_id}", headers=headers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire `ttl` seconds after being stored.
+
+    Only meant to be used from the event loop, so there is no locking.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class VersionedCache:
+    """Bounded LRU mapping of values tagged with the version they were built from.
+
+    An entry is served as is for `ttl` seconds; after that the caller has to confirm its
+    version with `revalidate` (a cheap lookup) instead of rebuilding the value. `sizeof`
+    estimates the memory held by a value: the least recently used entries go once the
+    total passes `maxbytes`, and a value bigger than a quarter of it is not stored at all,
+    so one huge entry cannot flush the rest.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, sizeof: Callable[[Any], int], maxbytes: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.oversized = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+
+    def get(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """Return (value, expired); value is None on a miss"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None, False
+        self._data.move_to_end(key)
+        expires, _, value, _ = item
+        if expires < time.monotonic():
+            return value, True
+        self.hits += 1
+        return value, False
+
+    def revalidate(self, key: Hashable, version: Any) -> bool:
+        """Keep an expired entry for another `ttl` if `version` is still current, drop it otherwise"""
+        item = self._data.get(key)
+        if item is not None and item[1] == version:
+            self._data[key] = (time.monotonic() + self.ttl, *item[1:])
+            self.hits += 1
+            self.revalidations += 1
+            return True
+        self.pop(key)
+        self.misses += 1
+        return False
+
+    def set(self, key: Hashable, version: Any, value: Any):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.maxbytes // 4:
+            self.oversized += 1
+            return
+        self._data[key] = (time.monotonic() + self.ttl, version, value, size)
+        self.nbytes += size
+        while len(self._data) > self.maxsize or self.nbytes > self.maxbytes:
+            self.nbytes -= self._data.popitem(last=False)[1][3]
+
+    def pop(self, key: Hashable):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[3]
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data), "maxsize": self.maxsize, "bytes": self.nbytes, "maxbytes": self.maxbytes,
+            "hits": self.hits, "misses": self.misses, "revalidations": self.revalidations, "oversized": self.oversized
+        }
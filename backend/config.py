@@ -11,6 +11,25 @@ class Settings(BaseSettings):
     ADMIN_SECRET_KEY: str
     ADMIN_USERNAME: str
     ADMIN_PASSWORD: str
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_LIMIT: int = 32
+    IMPORT_MAX_BYTES: int = 20 * 1024 * 1024
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    STUDY_SESSION_TTL_HOURS: int = 24
+    PUBLIC_DECK_CACHE_SIZE: int = 64
+    PUBLIC_DECK_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    PUBLIC_DECK_CACHE_TTL_SECONDS: int = 5
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 10
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_PGBOUNCER: bool = False
+    SLOW_QUERY_MS: float = 500
+    # bearer token for /metrics and /api/metrics; empty leaves them to admin sessions only
+    METRICS_TOKEN: str = ""
 
     class Config:
         env_file = "../.env"
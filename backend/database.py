@@ -1,5 +1,11 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+import time
+import uuid
+from bisect import bisect_left
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from config import settings
 
 
@@ -10,13 +16,110 @@ class Base(DeclarativeBase):
 from models import *
 
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+class PoolStats:
+    """Checkouts of the API engine's pool and how long they waited for a connection."""
+
+    def __init__(self):
+        self.checked_out = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_sum_ms = 0.0
+
+    def observe_wait(self, wait_ms: float):
+        self.wait_counts[bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+        self.wait_sum_ms += wait_ms
+
+    def stats(self, pool) -> dict:
+        # cumulative buckets, the way Prometheus histograms count
+        buckets, total = {}, 0
+        for bound, count in zip(WAIT_BUCKETS_MS + ("+Inf",), self.wait_counts):
+            total += count
+            buckets[str(bound)] = total
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else 0,
+            "checked_out": self.checked_out,
+            "overflow": max(pool.overflow(), 0) if hasattr(pool, "overflow") else 0,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_ms": {"buckets": buckets, "count": total, "sum": round(self.wait_sum_ms, 3)}
+        }
+
+
+pool_stats = PoolStats()
+
+
+class _TimedCheckout:
+    # there is no pool event before a checkout, so the wait is timed around the pool's own getter;
+    # it covers queueing for a free connection as well as opening a new one
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.observe_wait((time.perf_counter() - start) * 1000)
+
+
+class TimedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def _pool_options() -> dict:
+    if settings.DB_PGBOUNCER:
+        # pgbouncer in transaction mode does the pooling, a server connection never outlives a transaction
+        return {"poolclass": TimedNullPool}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING
+    }
+
+
+def _connect_args() -> dict:
+    if not settings.DB_PGBOUNCER:
+        return {}
+    # consecutive transactions may land on different server connections, so nothing can stay prepared
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4().hex}__"
+    }
+
+
+# one pool for the API and the admin panel; migrations open their own connection
+async_engine = create_async_engine(
+    make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg"),
+    connect_args=_connect_args(),
+    **_pool_options()
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.checked_out += 1
+    pool_stats.checkouts += 1
+
+
+@event.listens_for(async_engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.checked_out -= 1
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,160 @@
+"""Per-request latency and SQL instrumentation.
+
+The middleware times every HTTP request by route template and the cursor hooks count the
+statements the request sends and the time it spends in the database. Both go out as
+Prometheus histograms on /metrics and per response in a Server-Timing header. Statements
+slower than SLOW_QUERY_MS are logged together with their route.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from config import settings
+
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+LABELS = ("method", "route")
+UNMATCHED_ROUTE = "unmatched"
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    __slots__ = ("scope", "statements", "db_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.statements = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # routing fills in the matched route before the endpoint runs; raw paths would explode the label set
+        route = self.scope.get("route")
+        return route.path if route else UNMATCHED_ROUTE
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def render_histogram(name: str, help_text: str, bounds: Sequence[float], label_names: Sequence[str],
+                     series: Dict[tuple, Tuple[List[int], float]]) -> List[str]:
+    """Prometheus text lines of a histogram; series maps label values to per-bucket counts and a sum."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for values, (counts, total) in series.items():
+        labels = _labels(label_names, values)
+        prefix, suffix = (f"{labels},", f"{{{labels}}}") if labels else ("", "")
+        cumulative = 0
+        for bound, count in zip(tuple(bounds) + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{suffix} {total}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+    return lines
+
+
+def render_metric(name: str, metric_type: str, help_text: str, value: float) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series: Dict[tuple, Tuple[List[int], float]] = {}
+
+    def observe(self, labels: tuple, value: float):
+        counts, total = self.series.get(labels) or ([0] * (len(self.buckets) + 1), 0.0)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[labels] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        return render_histogram(self.name, self.help_text, self.buckets, LABELS, self.series)
+
+
+request_seconds = Histogram(
+    "flashcards_http_request_duration_seconds", "Time spent handling HTTP requests.", LATENCY_BUCKETS
+)
+request_statements = Histogram(
+    "flashcards_http_request_db_statements", "SQL statements sent per HTTP request.", STATEMENT_BUCKETS
+)
+request_db_seconds = Histogram(
+    "flashcards_http_request_db_duration_seconds", "Time spent in the database per HTTP request.", LATENCY_BUCKETS
+)
+
+
+def render() -> List[str]:
+    return request_seconds.render() + request_statements.render() + request_db_seconds.render()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_instrumentation_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    if settings.SLOW_QUERY_MS and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+        logger.warning("slow query (%.1f ms) on %s: %s", elapsed * 1000,
+                       stats.route if stats else "no request", statement)
+
+
+def instrument_engine(engine: Engine):
+    """Count and time the statements of an engine against the request that sends them."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class InstrumentationMiddleware:
+    """Pure ASGI, so streamed responses pass through untouched and no extra task breaks the context."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = (time.perf_counter() - start) * 1000
+                MutableHeaders(scope=message).append(
+                    "Server-Timing",
+                    f'app;dur={elapsed:.1f}, db;dur={stats.db_seconds * 1000:.1f};desc="statements: {stats.statements}"'
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            labels = (scope["method"], stats.route)
+            request_seconds.observe(labels, time.perf_counter() - start)
+            request_statements.observe(labels, stats.statements)
+            request_db_seconds.observe(labels, stats.db_seconds)
@@ -1,22 +1,22 @@
 from fastapi import FastAPI
 from sqladmin import Admin
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from utils import APIException
-from routes import auth, decks
-from database import engine, Base
+from routes import auth, decks, metrics
+from database import async_engine
+from instrumentation import InstrumentationMiddleware, instrument_engine
 from admin import BasicAuthBackend, UserAdmin, DeckAdmin, CardAdmin, UserProgressAdmin
 from config import settings
 
 
-Base.metadata.create_all(bind=engine)
-
-
 app = FastAPI(
     title="Flashcard API",
     description="Flashcards for studying",
     version="1.0.0",
+    # orjson renders the same compact UTF-8 JSON as the stdlib encoder, several times faster
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -47,10 +47,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Server-Timing"],
 )
 
+# added last so it wraps everything else and times the whole request
+app.add_middleware(InstrumentationMiddleware)
+instrument_engine(async_engine.sync_engine)
+
 auth_backend = BasicAuthBackend(secret_key=settings.ADMIN_SECRET_KEY)
-admin = Admin(app, engine, authentication_backend=auth_backend)
+admin = Admin(app, async_engine, authentication_backend=auth_backend)
 admin.add_view(UserAdmin)
 admin.add_view(DeckAdmin)
 admin.add_view(CardAdmin)
@@ -58,6 +63,8 @@ admin.add_view(UserProgressAdmin)
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(decks.router, prefix="/api/decks", tags=["decks"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
+app.include_router(metrics.prometheus_router, tags=["metrics"])
 
 
 @app.get("/")
@@ -0,0 +1,88 @@
+"""Maintenance commands
+
+    python manage.py check-counters
+    python manage.py rebuild-counters [--deck DECK_ID]
+    python manage.py purge-sessions        (from cron, e.g. hourly)
+    python manage.py seed [--users N] [--decks-per-user N] [--min-cards N] [--max-cards N] ...
+"""
+import argparse
+import asyncio
+import sys
+from database import AsyncSessionLocal
+from services import DeckService
+import seeding
+
+
+async def check_counters(args) -> int:
+    async with AsyncSessionLocal() as db:
+        decks, progress = await DeckService.check_counters(db)
+    for row in decks:
+        print(f"deck {row.id}: card_count={row.card_count} actual={row.actual}")
+    for row in progress:
+        print(f"user {row.user_id} deck {row.deck_id}: learned={row.learned} actual={row.actual}")
+    print(f"{len(decks)} deck(s) and {len(progress)} progress counter(s) drifted")
+    return 1 if decks or progress else 0
+
+
+async def rebuild_counters(args) -> int:
+    async with AsyncSessionLocal() as db:
+        await DeckService.rebuild_counters(db, args.deck)
+        await db.commit()
+    print("counters rebuilt")
+    return 0
+
+
+async def purge_sessions(args) -> int:
+    async with AsyncSessionLocal() as db:
+        purged = await DeckService.purge_sessions(db)
+    print(f"{purged} expired study session(s) purged")
+    return 0
+
+
+async def seed(args) -> int:
+    options = seeding.SeedOptions(**{
+        name: value for name, value in vars(args).items() if name in seeding.SeedOptions.__dataclass_fields__
+    })
+    result = await seeding.seed(options)
+    rows = sum(count for name, count in result.items() if name not in ("seconds", "username_prefix"))
+    for name in ("users", "decks", "cards", "user_progress", "deck_progress"):
+        print(f"{name}: {result[name]}")
+    print(f"{rows} rows in {result['seconds']}s, users are {result['username_prefix']}-<n> "
+          f"with password {options.password!r}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Flashcards maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("check-counters", help="report drifted card/learned counters").set_defaults(func=check_counters)
+    rebuild = commands.add_parser("rebuild-counters", help="recompute card/learned counters")
+    rebuild.add_argument("--deck", type=int, default=None, help="only this deck")
+    rebuild.set_defaults(func=rebuild_counters)
+    commands.add_parser(
+        "purge-sessions", help="delete study sessions older than STUDY_SESSION_TTL_HOURS"
+    ).set_defaults(func=purge_sessions)
+    defaults = seeding.SeedOptions()
+    seed_parser = commands.add_parser("seed", help="bulk-load synthetic users, decks, cards and progress")
+    seed_parser.add_argument("--users", type=int, default=defaults.users)
+    seed_parser.add_argument("--decks-per-user", type=int, default=defaults.decks_per_user)
+    seed_parser.add_argument("--min-cards", type=int, default=defaults.min_cards)
+    seed_parser.add_argument("--max-cards", type=int, default=defaults.max_cards)
+    seed_parser.add_argument("--distribution", choices=seeding.DISTRIBUTIONS, default=defaults.distribution,
+                             help="deck sizes between min and max cards")
+    seed_parser.add_argument("--learned-ratio", type=float, default=defaults.learned_ratio,
+                             help="share of a deck's cards each learner has learned")
+    seed_parser.add_argument("--public-ratio", type=float, default=defaults.public_ratio,
+                             help="share of decks without an owner")
+    seed_parser.add_argument("--public-learners", type=int, default=defaults.public_learners,
+                             help="random users with progress on every public deck")
+    seed_parser.add_argument("--password", default=defaults.password, help="password of every seeded user")
+    seed_parser.add_argument("--batch-size", type=int, default=defaults.batch_size, help="rows per COPY")
+    seed_parser.add_argument("--random-seed", type=int, default=defaults.random_seed)
+    seed_parser.set_defaults(func=seed)
+    args = parser.parse_args()
+    return asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""Composite indexes for progress and card lookups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-11-03 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # keep one progress row per (user, card): the learned one if any, otherwise the oldest
+    op.execute("""
+        DELETE FROM user_progress p
+        USING user_progress keep
+        WHERE p.user_id = keep.user_id
+          AND p.card_id = keep.card_id
+          AND p.id <> keep.id
+          AND (COALESCE(keep.learned, false), -keep.id) > (COALESCE(p.learned, false), -p.id)
+    """)
+    op.create_unique_constraint("uq_user_progress_user_card", "user_progress", ["user_id", "card_id"])
+    op.create_index("ix_user_progress_user_deck", "user_progress", ["user_id", "deck_id"])
+    op.create_index("ix_user_progress_learned", "user_progress", ["user_id", "deck_id", "card_id"],
+                    postgresql_where=sa.text("learned"))
+    op.create_index("ix_user_progress_card_id", "user_progress", ["card_id"])
+    op.create_index("ix_cards_deck_id_id", "cards", ["deck_id", "id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_cards_deck_id_id", table_name="cards")
+    op.drop_index("ix_user_progress_card_id", table_name="user_progress")
+    op.drop_index("ix_user_progress_learned", table_name="user_progress")
+    op.drop_index("ix_user_progress_user_deck", table_name="user_progress")
+    op.drop_constraint("uq_user_progress_user_card", "user_progress", type_="unique")
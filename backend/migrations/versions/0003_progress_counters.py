@@ -0,0 +1,47 @@
+"""Materialized card and learned counters
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-11-04 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("decks", sa.Column("card_count", sa.Integer(), nullable=False, server_default="0"))
+    op.create_table(
+        "deck_progress",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("deck_id", sa.Integer(), nullable=False),
+        sa.Column("learned", sa.Integer(), nullable=False, server_default="0"),
+        sa.ForeignKeyConstraint(["deck_id"], ["decks.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "deck_id"),
+    )
+    op.execute("""
+        UPDATE decks SET card_count = (SELECT count(*) FROM cards WHERE cards.deck_id = decks.id)
+    """)
+    op.execute("""
+        INSERT INTO deck_progress (user_id, deck_id, learned)
+        SELECT user_id, deck_id, count(*) FROM user_progress
+        WHERE learned AND user_id IS NOT NULL AND deck_id IS NOT NULL
+        GROUP BY user_id, deck_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("deck_progress")
+    op.drop_column("decks", "card_count")
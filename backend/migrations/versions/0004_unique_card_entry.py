@@ -0,0 +1,69 @@
+"""Unique card entry per deck
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-11-06 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the oldest card of every duplicated entry stays, its twins are merged into it
+    op.execute("""
+        CREATE TEMPORARY TABLE card_twins AS
+        SELECT c.id AS twin_id, keep.id AS keep_id
+        FROM cards c
+        JOIN (SELECT deck_id, entry, min(id) AS id FROM cards GROUP BY deck_id, entry HAVING count(*) > 1) keep
+            ON c.deck_id = keep.deck_id AND c.entry = keep.entry AND c.id <> keep.id
+    """)
+    # a card learned under any of its twins stays learned
+    op.execute("""
+        UPDATE user_progress p SET learned = true
+        FROM card_twins t
+        JOIN user_progress twin ON twin.card_id = t.twin_id
+        WHERE p.card_id = t.keep_id AND p.user_id = twin.user_id AND twin.learned
+    """)
+    # users who only studied a twin take their progress of it over to the kept card, a learned one first
+    op.execute("""
+        UPDATE user_progress p SET card_id = moved.keep_id
+        FROM (
+            SELECT DISTINCT ON (twin.user_id, t.keep_id) twin.id, t.keep_id
+            FROM card_twins t
+            JOIN user_progress twin ON twin.card_id = t.twin_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_progress k WHERE k.card_id = t.keep_id AND k.user_id = twin.user_id
+            )
+            ORDER BY twin.user_id, t.keep_id, twin.learned IS TRUE DESC
+        ) moved
+        WHERE p.id = moved.id
+    """)
+    # the rest of the twins' progress goes with them through the foreign key cascade
+    op.execute("DELETE FROM cards WHERE id IN (SELECT twin_id FROM card_twins)")
+    op.execute("DROP TABLE card_twins")
+    op.execute("""
+        UPDATE decks SET card_count = (SELECT count(*) FROM cards WHERE cards.deck_id = decks.id)
+    """)
+    op.execute("""
+        UPDATE deck_progress SET learned = (
+            SELECT count(*) FROM user_progress p
+            WHERE p.user_id = deck_progress.user_id AND p.deck_id = deck_progress.deck_id AND p.learned
+        )
+    """)
+    op.create_unique_constraint("uq_cards_deck_entry", "cards", ["deck_id", "entry"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("uq_cards_deck_entry", "cards", type_="unique")
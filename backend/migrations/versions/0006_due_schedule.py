@@ -0,0 +1,36 @@
+"""Spaced repetition schedule
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-11-14 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("user_progress", sa.Column("interval_days", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("user_progress", sa.Column("ease", sa.Float(), nullable=False, server_default="2.5"))
+    op.add_column("user_progress", sa.Column("repetitions", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("user_progress", sa.Column("due_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index("ix_user_progress_due", "user_progress", ["user_id", "deck_id", "due_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_user_progress_due", table_name="user_progress")
+    op.drop_column("user_progress", "due_at")
+    op.drop_column("user_progress", "repetitions")
+    op.drop_column("user_progress", "ease")
+    op.drop_column("user_progress", "interval_days")
@@ -0,0 +1,36 @@
+"""Trigram indexes for card search
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-11-25 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # pg_trgm is a trusted extension, the database owner can create it
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # built concurrently so a large cards table keeps taking writes meanwhile
+    with op.get_context().autocommit_block():
+        for column in ("entry", "value"):
+            op.create_index(f"ix_cards_{column}_trgm", "cards", [column], postgresql_using="gin",
+                            postgresql_ops={column: "gin_trgm_ops"}, postgresql_concurrently=True,
+                            if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_cards_value_trgm", table_name="cards")
+    op.drop_index("ix_cards_entry_trgm", table_name="cards")
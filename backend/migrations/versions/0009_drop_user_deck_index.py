@@ -0,0 +1,29 @@
+"""Drop ix_user_progress_user_deck, a prefix of ix_user_progress_due
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-11-27 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, Sequence[str], None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # (user_id, deck_id, due_at) serves every (user_id, deck_id) lookup, the narrower copy only costs writes
+    op.drop_index("ix_user_progress_user_deck", table_name="user_progress")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index("ix_user_progress_user_deck", "user_progress", ["user_id", "deck_id"])
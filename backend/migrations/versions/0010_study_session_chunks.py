@@ -0,0 +1,62 @@
+"""Study session order in chunk rows
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2025-11-28 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, Sequence[str], None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# models.SESSION_CHUNK_SIZE when this revision was written
+CHUNK_SIZE = 100
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "study_session_chunks",
+        sa.Column("session_id", sa.String(length=32), nullable=False),
+        sa.Column("chunk", sa.Integer(), nullable=False),
+        sa.Column("card_ids", postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.ForeignKeyConstraint(["session_id"], ["study_sessions.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("session_id", "chunk"),
+    )
+    op.add_column("study_sessions", sa.Column("size", sa.Integer(), nullable=False, server_default="0"))
+    # running sessions keep their order and position
+    op.execute("UPDATE study_sessions SET size = cardinality(card_ids)")
+    op.execute(f"""
+        INSERT INTO study_session_chunks (session_id, chunk, card_ids)
+        SELECT id, chunk, card_ids[chunk * {CHUNK_SIZE} + 1:(chunk + 1) * {CHUNK_SIZE}]
+        FROM study_sessions, generate_series(0, (cardinality(card_ids) + {CHUNK_SIZE} - 1) / {CHUNK_SIZE} - 1) AS chunk
+    """)
+    op.alter_column("study_sessions", "size", server_default=None)
+    op.drop_column("study_sessions", "card_ids")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column("study_sessions", sa.Column("card_ids", postgresql.ARRAY(sa.Integer()), nullable=False,
+                                              server_default="{}"))
+    op.execute("""
+        UPDATE study_sessions SET card_ids = merged.card_ids
+        FROM (
+            SELECT session_id, array_agg(card_id ORDER BY chunk, position) AS card_ids
+            FROM study_session_chunks, unnest(card_ids) WITH ORDINALITY AS ids(card_id, position)
+            GROUP BY session_id
+        ) AS merged
+        WHERE merged.session_id = study_sessions.id
+    """)
+    op.alter_column("study_sessions", "card_ids", server_default=None)
+    op.drop_column("study_sessions", "size")
+    op.drop_table("study_session_chunks")
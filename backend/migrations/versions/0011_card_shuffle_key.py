@@ -0,0 +1,41 @@
+"""Add cards.shuffle_key and walked study sessions for sort-free shuffles
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2025-12-04 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, Sequence[str], None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a volatile default rewrites the table once and draws a key for every existing card
+    op.add_column("cards", sa.Column(
+        "shuffle_key", sa.Integer(), nullable=False,
+        server_default=sa.text("floor(random() * 2147483647)::integer")
+    ))
+    op.create_index("ix_cards_deck_shuffle", "cards", ["deck_id", "shuffle_key", "id"])
+    # running sessions keep their chunks and stay snapshotted
+    op.add_column("study_sessions", sa.Column("mode", sa.String(length=16), nullable=True))
+    op.add_column("study_sessions", sa.Column("start_key", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # walked sessions have no chunks to fall back on
+    op.execute("DELETE FROM study_sessions WHERE start_key IS NOT NULL")
+    op.drop_column("study_sessions", "start_key")
+    op.drop_column("study_sessions", "mode")
+    op.drop_index("ix_cards_deck_shuffle", table_name="cards")
+    op.drop_column("cards", "shuffle_key")
@@ -1,5 +1,7 @@
 from enum import IntEnum, Enum
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, SmallInteger, Boolean, DateTime
+from sqlalchemy import (Column, Integer, String, ForeignKey, Text, SmallInteger, Boolean, DateTime, Float, Index,
+                        UniqueConstraint, text)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -8,6 +10,8 @@ LANGUAGE_MAP = {"en": 1, "ru": 2, "de": 3, "zh": 4, "es": 5, "fr": 6, "ko": 7, "
 LANGUAGE_REVERSE_MAP = {1: "en", 2: "ru", 3: "de", 4: "zh", 5: "es", 6: "fr", 7: "ko", 8: "ja"}
 COLOR_MAP = {"yellow": 1, "green": 2, "pink": 3}
 COLOR_REVERSE_MAP = {1: "yellow", 2: "green", 3: "pink"}
+SHUFFLE_KEY_RANGE = 2147483647
+SESSION_CHUNK_SIZE = 100
 
 
 class Color(IntEnum):
@@ -31,6 +35,7 @@ class StudyMode(Enum):
     UNLEARNED = "unlearned"
     LEARNED = "learned"
     ALL = "all"
+    DUE = "due"
 
 
 class User(Base):
@@ -50,6 +55,9 @@ class Deck(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    card_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # bumped on every change of the name or the cards, the ETag of the deck's listings
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     owner = relationship("User", back_populates="decks")
     cards = relationship("Card", back_populates="deck", cascade="all, delete-orphan")
     user_progress = relationship("UserProgress", back_populates="deck", cascade="all, delete-orphan")
@@ -57,21 +65,76 @@ class Deck(Base):
 
 class Card(Base):
     __tablename__ = "cards"
+    __table_args__ = (
+        Index("ix_cards_deck_id_id", "deck_id", "id"),
+        # study order: sessions read a deck's cards along it from a random key, so nothing is sorted
+        Index("ix_cards_deck_shuffle", "deck_id", "shuffle_key", "id"),
+        UniqueConstraint("deck_id", "entry", name="uq_cards_deck_entry"),
+        # pg_trgm indexes behind ILIKE '%term%' searches
+        Index("ix_cards_entry_trgm", "entry", postgresql_using="gin", postgresql_ops={"entry": "gin_trgm_ops"}),
+        Index("ix_cards_value_trgm", "value", postgresql_using="gin", postgresql_ops={"value": "gin_trgm_ops"}),
+    )
     id = Column(Integer, primary_key=True, index=True)
     entry = Column(Text)
     value = Column(Text)
     deck_id = Column(Integer, ForeignKey("decks.id", ondelete="CASCADE"))
+    # drawn once per card by the database, whichever path inserts it
+    shuffle_key = Column(Integer, nullable=False,
+                         server_default=text(f"floor(random() * {SHUFFLE_KEY_RANGE})::integer"))
     user_progress = relationship("UserProgress", back_populates="card", cascade="all, delete-orphan")
     deck = relationship("Deck", back_populates="cards")
 
 
 class UserProgress(Base):
     __tablename__ = "user_progress"
+    __table_args__ = (
+        UniqueConstraint("user_id", "card_id", name="uq_user_progress_user_card"),
+        Index("ix_user_progress_learned", "user_id", "deck_id", "card_id", postgresql_where=text("learned")),
+        Index("ix_user_progress_card_id", "card_id"),
+        Index("ix_user_progress_due", "user_id", "deck_id", "due_at"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     card_id = Column(Integer, ForeignKey("cards.id", ondelete="CASCADE"))
     deck_id = Column(Integer, ForeignKey("decks.id", ondelete="CASCADE"))
     learned = Column(Boolean, default=False)
+    # SM-2 schedule; due_at stays NULL until the card is reviewed for the first time
+    interval_days = Column(Integer, nullable=False, default=0, server_default="0")
+    ease = Column(Float, nullable=False, default=2.5, server_default="2.5")
+    repetitions = Column(Integer, nullable=False, default=0, server_default="0")
+    due_at = Column(DateTime(timezone=True), nullable=True)
     user = relationship("User", back_populates="user_progress")
     card = relationship("Card", back_populates="user_progress")
     deck = relationship("Deck", back_populates="user_progress")
+
+
+class DeckProgress(Base):
+    __tablename__ = "deck_progress"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    deck_id = Column(Integer, ForeignKey("decks.id", ondelete="CASCADE"), primary_key=True)
+    learned = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class StudySession(Base):
+    """One study session. Due sessions and small ones snapshot their card order into chunks when they
+    start; the others keep a random start_key and walk ix_cards_deck_shuffle from it, wrapping round.
+    Clients carry the id and their position, so the session rows are never written after creation."""
+    __tablename__ = "study_sessions"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    deck_id = Column(Integer, ForeignKey("decks.id", ondelete="CASCADE"), nullable=False)
+    size = Column(Integer, nullable=False)
+    # set for walked sessions only, NULL for snapshotted ones
+    mode = Column(String(16), nullable=True)
+    start_key = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=text("now()"), index=True)
+
+
+class StudySessionChunk(Base):
+    """SESSION_CHUNK_SIZE consecutive card ids of a session's order. Small enough to be stored inline,
+    so a step walks the chunks from its position instead of decompressing the order of the whole deck.
+    Changing SESSION_CHUNK_SIZE breaks the running sessions."""
+    __tablename__ = "study_session_chunks"
+    session_id = Column(String(32), ForeignKey("study_sessions.id", ondelete="CASCADE"), primary_key=True)
+    chunk = Column(Integer, primary_key=True)
+    card_ids = Column(ARRAY(Integer), nullable=False)
@@ -1,12 +1,14 @@
 """Auth routes"""
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from models import User, Color, Language, LANGUAGE_REVERSE_MAP, COLOR_REVERSE_MAP
 from services import UserService
 from auth import (
-    verify_password, create_access_token, create_refresh_token, decode_refresh_token,
-    get_current_user
+    check_password, hash_password, password_needs_rehash,
+    create_access_token, create_refresh_token, decode_refresh_token,
+    get_current_user, get_principal, Principal
 )
 from schemas import auth as auth_schema
 from utils import APIException
@@ -16,28 +18,35 @@ router = APIRouter()
 
 
 @router.post("/register")
-def register(user_data: auth_schema.UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: auth_schema.UserCreate, db: AsyncSession = Depends(get_db)):
     """Register"""
-    if db.query(User).filter(User.username == user_data.username).first():
+    if await db.scalar(select(User.id).where(User.username == user_data.username)):
         raise APIException(localization_key='error.user_username_exist', status_code=409)
-    if db.query(User).filter(User.email == user_data.email).first():
+    if await db.scalar(select(User.id).where(User.email == user_data.email)):
         raise APIException(localization_key='error.user_email_exist', status_code=409)
-    user = UserService.create_user(db, user_data)
+    user = await UserService.create_user(db, user_data)
     return {"user_id": user.id}
 
 
 @router.post("/login")
-def login(login_data: auth_schema.UserLogin, db: Session = Depends(get_db)):
+async def login(login_data: auth_schema.UserLogin, db: AsyncSession = Depends(get_db)):
     """Login"""
-    user = db.query(User).filter(User.username == login_data.username).first()
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    user = await db.scalar(select(User).where(User.username == login_data.username))
+    if not user or not await check_password(login_data.password, user.hashed_password):
         raise APIException(localization_key='error.incorrect_username_or_password', status_code=400)
+    if password_needs_rehash(user.hashed_password):
+        try:
+            user.hashed_password = await hash_password(login_data.password)
+            await db.commit()
+        except APIException:
+            # the hashing pool is saturated, upgrade on a later login
+            pass
     return {"access": create_access_token({"sub": user.username}),
             "refresh": create_refresh_token({"sub": user.username})}
 
 
 @router.post("/refresh")
-def refresh_token(token_data: auth_schema.RefreshRequest, db: Session = Depends(get_db)):
+async def refresh_token(token_data: auth_schema.RefreshRequest, db: AsyncSession = Depends(get_db)):
     """Refresh token"""
     token = token_data.refresh
     if not token:
@@ -49,7 +58,7 @@ def refresh_token(token_data: auth_schema.RefreshRequest, db: Session = Depends(
             raise APIException(localization_key='error.invalid_token', status_code=401)
     except Exception:
         raise APIException(localization_key='error.invalid_refresh_token', status_code=401)
-    user = db.query(User).filter(User.username == username).first()
+    user = await get_principal(db, username)
     if not user:
         raise APIException(localization_key='error.user_not_found', status_code=401)
     new_access = create_access_token({"sub": username})
@@ -57,7 +66,7 @@ def refresh_token(token_data: auth_schema.RefreshRequest, db: Session = Depends(
 
 
 @router.get("/me")
-def me(current_user: User = Depends(get_current_user)):
+async def me(current_user: Principal = Depends(get_current_user)):
     return {
         "username": current_user.username,
         "color": COLOR_REVERSE_MAP[current_user.color or Color.YELLOW],
@@ -66,8 +75,9 @@ def me(current_user: User = Depends(get_current_user)):
 
 
 @router.patch("/me")
-def me(user_data: auth_schema.UserUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    user = UserService.update_user(db, current_user.id, user_data)
+async def me(user_data: auth_schema.UserUpdate, current_user: Principal = Depends(get_current_user),
+             db: AsyncSession = Depends(get_db)):
+    user = await UserService.update_user(db, current_user.id, user_data)
     if not user:
         raise APIException(localization_key='error.user_not_found', status_code=404)
     return {
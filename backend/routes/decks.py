@@ -1,103 +1,204 @@
 """Deck routes"""
-from fastapi import APIRouter, Depends, UploadFile, File, Query
+import hashlib
+from urllib.parse import quote
+from typing import List, Optional
+from fastapi import APIRouter, Depends, UploadFile, File, Query, Request, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from database import get_db
-from models import Deck, User
-from auth import get_optional_user, get_current_user
-from services import DeckService
+from models import Deck
+from auth import Principal, get_optional_user, get_current_user
+from services import DeckService, PUBLIC_SESSION
 from schemas import deck as deck_schema
-from utils import APIException
+from utils import APIException, etag_matches
+from config import settings
+import spreadsheet
 
 
+DECK_PAGE_SIZE = 100
+CARD_PAGE_SIZE = 1000
+SEARCH_PAGE_SIZE = 20
+# the trigram indexes need a word of three characters or more, without one a search reads every card
+SEARCH_QUERY_PATTERN = r"[^\W_]{3}"
+# "<rank>:<card id>" of the last result, rank as Python prints the float
+SEARCH_CURSOR_PATTERN = r"^\d+(\.\d+)?(e-\d+)?:\d+$"
+PUBLIC_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+
 router = APIRouter()
 
 
-@router.get("")
-def get_user_decks(show_all: bool = Query(False), db: Session = Depends(get_db),
-                   current_user: User = Depends(get_optional_user)):
-    decks = DeckService.get_user_decks(db, user_id=current_user.id if current_user else None, show_all=show_all)
+def _cache_headers(request: Request, etag: str, public: bool) -> dict:
+    # the same URL answers differently with a token, so caches key on it; shared caches may keep only
+    # what an anonymous request gets for public decks, which is the same for everybody
+    public = public and "authorization" not in request.headers
+    return {
+        "ETag": etag,
+        "Cache-Control": PUBLIC_CACHE_CONTROL if public else "private, no-cache",
+        "Vary": "Authorization"
+    }
+
+
+@router.get("", response_model=List[deck_schema.DeckResponse])
+async def get_user_decks(request: Request, response: Response, show_all: bool = Query(False),
+                         limit: int = Query(DECK_PAGE_SIZE, ge=1, le=1000), after: Optional[int] = Query(None),
+                         with_total: bool = Query(False), db: AsyncSession = Depends(get_db),
+                         current_user: Principal = Depends(get_optional_user)):
+    user_id = current_user.id if current_user else None
+    # fetch one extra row to know whether another page follows
+    decks = await DeckService.get_user_decks(db, user_id=user_id, show_all=show_all, limit=limit + 1, after=after)
+    total = await DeckService.count_user_decks(db, user_id, show_all) if with_total else None
+    # deck versions cover renames and card edits, ids cover created and deleted decks
+    fingerprint = ",".join(f"{deck.id}.{deck.version}" for deck in decks) + f";{total}"
+    headers = _cache_headers(request, f'"{hashlib.md5(fingerprint.encode()).hexdigest()}"', public=user_id is None)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    if len(decks) > limit:
+        decks = decks[:limit]
+        response.headers["X-Next-Cursor"] = str(decks[-1].id)
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
     return [{"id": deck.id, "name": deck.name} for deck in decks]
 
 
-@router.post("")
-def create_deck(deck_data: deck_schema.DeckCreate, db: Session = Depends(get_db),
-                current_user: User = Depends(get_current_user)):
-    if db.query(Deck).filter(Deck.name == deck_data.name, Deck.user_id == current_user.id).first():
+async def _search_cards(db: AsyncSession, query: str, user_id: Optional[int], deck: Optional[Deck], limit: int,
+                       after: Optional[str]):
+    cursor = None
+    if after is not None:
+        rank, card_id = after.split(":")
+        cursor = (float(rank), int(card_id))
+    cards = await DeckService.search_cards(db, query, user_id, deck, limit=limit + 1, after=cursor)
+    next_cursor = None
+    if len(cards) > limit:
+        cards = cards[:limit]
+        next_cursor = f"{cards[-1].rank!r}:{cards[-1].id}"
+    return {
+        "cards": [{"id": card.id, "deck_id": card.deck_id, "entry": card.entry, "value": card.value} for card in cards],
+        "next_cursor": next_cursor
+    }
+
+
+@router.get("/search", response_model=deck_schema.CardSearchResponse)
+async def search_cards(q: str = Query(..., max_length=100, pattern=SEARCH_QUERY_PATTERN),
+                       limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=100),
+                       after: Optional[str] = Query(None, pattern=SEARCH_CURSOR_PATTERN),
+                       db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_optional_user)):
+    return await _search_cards(db, q, current_user.id if current_user else None, None, limit, after)
+
+
+@router.post("", response_model=deck_schema.DeckResponse)
+async def create_deck(deck_data: deck_schema.DeckCreate, db: AsyncSession = Depends(get_db),
+                      current_user: Principal = Depends(get_current_user)):
+    if await db.scalar(select(Deck.id).where(Deck.name == deck_data.name, Deck.user_id == current_user.id)):
         raise APIException(localization_key='error.deck_name_exist', status_code=409)
-    deck = DeckService.create_deck(db, deck_data.name, current_user.id)
+    deck = await DeckService.create_deck(db, deck_data.name, current_user.id)
     return {"id": deck.id, "name": deck.name}
 
 
-@router.put("/{deck_id}")
-def update_deck(deck_id: int, deck_data: deck_schema.DeckUpdate, db: Session = Depends(get_db),
-                current_user: User = Depends(get_current_user)):
-    if db.query(Deck).filter(Deck.name == deck_data.name, Deck.id != deck_id, Deck.user_id == current_user.id).first():
+@router.put("/{deck_id}", response_model=deck_schema.DeckResponse)
+async def update_deck(deck_id: int, deck_data: deck_schema.DeckUpdate, db: AsyncSession = Depends(get_db),
+                      current_user: Principal = Depends(get_current_user)):
+    if await db.scalar(select(Deck.id).where(Deck.name == deck_data.name, Deck.id != deck_id,
+                                            Deck.user_id == current_user.id)):
         raise APIException(localization_key='error.deck_name_exist', status_code=409)
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    deck = DeckService.update_deck(db, deck, deck_data.name)
+    deck = await DeckService.update_deck(db, deck, deck_data.name)
     return {"id": deck.id, "name": deck.name}
 
 
-@router.delete("/{deck_id}")
-def delete_deck(deck_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+@router.delete("/{deck_id}", response_model=deck_schema.StatusResponse)
+async def delete_deck(deck_id: int, db: AsyncSession = Depends(get_db),
+                      current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    DeckService.delete_deck(db, deck)
+    await DeckService.delete_deck(db, deck)
     return {"status": True}
 
 
-@router.get("/{deck_id}/cards")
-def get_deck_cards(deck_id: int, db: Session = Depends(get_db),
-                   current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+@router.get("/{deck_id}/cards", response_model=deck_schema.CardPageResponse, response_model_exclude_unset=True)
+async def get_deck_cards(request: Request, response: Response, deck_id: int,
+                         limit: int = Query(CARD_PAGE_SIZE, ge=1, le=5000), after: Optional[int] = Query(None),
+                         with_total: bool = Query(False), db: AsyncSession = Depends(get_db),
+                         current_user: Principal = Depends(get_optional_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id if current_user else None, show_all=True)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    cards = DeckService.get_deck_cards(db, deck)
-    return {"cards": [{"entry": card.entry, "value": card.value} for card in cards]}
+    # the page and the total are part of the URL, so the deck version alone identifies the representation
+    headers = _cache_headers(request, f'"{deck.id}.{deck.version}"', public=deck.user_id is None)
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    cards = await DeckService.get_deck_cards(db, deck, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(cards) > limit:
+        cards = cards[:limit]
+        next_cursor = cards[-1].id
+    data = {
+        "cards": [{"id": card.id, "entry": card.entry, "value": card.value} for card in cards],
+        "next_cursor": next_cursor
+    }
+    if with_total:
+        data["total"] = deck.card_count
+    return data
 
 
-@router.put("/{deck_id}/cards")
-def update_deck_cards(deck_id: int, cards_data: deck_schema.Cards, db: Session = Depends(get_db),
-                      current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+@router.get("/{deck_id}/search", response_model=deck_schema.CardSearchResponse)
+async def search_deck_cards(deck_id: int, q: str = Query(..., max_length=100, pattern=SEARCH_QUERY_PATTERN),
+                            limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=100),
+                            after: Optional[str] = Query(None, pattern=SEARCH_CURSOR_PATTERN),
+                            db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_optional_user)):
+    user_id = current_user.id if current_user else None
+    deck = await DeckService.get_user_deck(db, deck_id, user_id, show_all=True)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    cards = DeckService.update_deck_cards(db, deck, cards_data.cards)
+    return await _search_cards(db, q, user_id, deck, limit, after)
+
+
+@router.put("/{deck_id}/cards", response_model=deck_schema.CardsResponse)
+async def update_deck_cards(deck_id: int, cards_data: deck_schema.Cards, db: AsyncSession = Depends(get_db),
+                            current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id)
+    if not deck:
+        raise APIException(localization_key='error.deck_not_found', status_code=404)
+    cards = await DeckService.update_deck_cards(db, deck, cards_data.cards)
     return {"cards": [{"entry": card.entry, "value": card.value} for card in cards]}
 
 
 @router.get("/{deck_id}/export")
-def export_deck_cards(deck_id: int, db: Session = Depends(get_db),
-                      current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+async def export_deck_cards(deck_id: int, db: AsyncSession = Depends(get_db),
+                            current_user: Principal = Depends(get_current_user),
+                            export_format: str = Query("xlsx", alias="format", pattern="^(xlsx|csv|ndjson)$")):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    output, filename = DeckService.export_cards(db, deck)
+    stream, filename = DeckService.export_cards(deck, export_format)
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        stream,
+        media_type=spreadsheet.EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
     )
 
 
-@router.post("/{deck_id}/import")
-def import_excel(deck_id: int, file: UploadFile = File(..., max_size=500 * 1024),
-                 db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+@router.post("/{deck_id}/import", response_model=deck_schema.StatusResponse)
+async def import_excel(deck_id: int, file: UploadFile = File(..., max_size=settings.IMPORT_MAX_BYTES),
+                       db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    if not file.filename.endswith(('.xlsx', '.xls')):
+    if not file.filename.endswith(spreadsheet.IMPORT_EXTENSIONS):
         raise APIException(status_code=400, localization_key="only_excel")
+    if file.size is not None and file.size > settings.IMPORT_MAX_BYTES:
+        raise APIException(status_code=413, localization_key="error.import_failed")
     try:
-        cards_data = DeckService.read_excel_cards(file)
-        if isinstance(cards_data, str):
-            raise APIException(status_code=400, localization_key=cards_data)
-        cards_data = [deck_schema.Card(**card) for card in cards_data]
-        DeckService.update_deck_cards(db, deck, cards_data, replace=True)
+        cards = await run_in_threadpool(spreadsheet.read_cards, file.file, file.filename)
+        if isinstance(cards, str):
+            raise APIException(status_code=400, localization_key=cards)
+        await DeckService.import_cards(db, deck, cards)
     except APIException:
         raise
     except Exception:
@@ -107,50 +208,103 @@ def import_excel(deck_id: int, file: UploadFile = File(..., max_size=500 * 1024)
     return {"status": True}
 
 
-@router.post("/{deck_id}/next-card")
-def get_next_card(deck_id: int, data: deck_schema.NextCard, db: Session = Depends(get_db),
-                  current_user: User = Depends(get_optional_user)):
-    if current_user is not None:
-        deck = DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
+@router.post("/{deck_id}/sessions", response_model=deck_schema.SessionResponse)
+async def start_session(deck_id: int, data: deck_schema.StudySessionCreate, db: AsyncSession = Depends(get_db),
+                        current_user: Principal = Depends(get_optional_user)):
+    if current_user is None:
+        # guests only see public decks, which are studied straight from the process cache
+        if not await DeckService.get_public_deck(db, deck_id):
+            raise APIException(localization_key='error.deck_not_found', status_code=404)
+        return {"session": f"{PUBLIC_SESSION}:0"}
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
+    if not deck:
+        raise APIException(localization_key='error.deck_not_found', status_code=404)
+    session = await DeckService.start_session(db, deck, current_user.id, data.mode)
+    return {"session": session}
+
+
+async def _next_cards(db: AsyncSession, deck_id: int, current_user: Optional[Principal], session: str, count: int):
+    if current_user is None:
+        deck = await DeckService.get_public_deck(db, deck_id)
         if not deck:
             raise APIException(localization_key='error.deck_not_found', status_code=404)
-        progress_card, remain = DeckService.get_next_card(db, current_user.id, deck, data.mode, data.exclude)
+        result = DeckService.get_next_public_cards(deck, session, count)
     else:
-        deck = DeckService.get_user_deck(db, deck_id, user_id=None, show_all=True)
+        deck = await DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
         if not deck:
             raise APIException(localization_key='error.deck_not_found', status_code=404)
-        progress_card, remain = DeckService.get_next_guest_card(db, deck, data.exclude)
-    stats = DeckService.get_statistics(db, current_user.id if current_user else None, deck)
-    stats["remain"] = remain
-    if not progress_card:
-        return {"card": None, "stats": stats}
+        result = await DeckService.get_next_cards(db, current_user.id, deck, session, count)
+    if result is None:
+        raise APIException(localization_key='error.session_not_found', status_code=404)
+    return result
+
+
+@router.post("/{deck_id}/next-card", response_model=deck_schema.NextCardResponse)
+async def get_next_card(deck_id: int, data: deck_schema.NextCard, db: AsyncSession = Depends(get_db),
+                        current_user: Principal = Depends(get_optional_user)):
+    cards, stats, session = await _next_cards(db, deck_id, current_user, data.session, 1)
+    return {
+        "card": cards[0] if cards else None,
+        "stats": stats,
+        "session": session
+    }
+
+
+@router.post("/{deck_id}/next-cards", response_model=deck_schema.NextCardsResponse)
+async def get_next_cards(deck_id: int, data: deck_schema.NextCards, db: AsyncSession = Depends(get_db),
+                         current_user: Principal = Depends(get_optional_user)):
+    cards, stats, session = await _next_cards(db, deck_id, current_user, data.session, data.count)
     return {
-        "card": progress_card,
-        "stats": stats
+        "cards": cards,
+        "stats": stats,
+        "session": session
     }
 
 
-@router.patch("/{deck_id}/toggle_learned")
-def toggle_learned(deck_id: int, data: deck_schema.ToggleLearned, db: Session = Depends(get_db),
-                   current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
+@router.patch("/{deck_id}/toggle_learned", response_model=deck_schema.ToggleLearnedResponse)
+async def toggle_learned(deck_id: int, data: deck_schema.ToggleLearned, db: AsyncSession = Depends(get_db),
+                         current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    card = DeckService.get_deck_card(db, deck, data.card_id)
+    card = await DeckService.get_deck_card(db, deck, data.card_id)
     if not card:
         raise APIException(localization_key='error.card_not_found', status_code=404)
-    progress = DeckService.toggle_learned(db, current_user.id, deck, card)
-    if not progress:
-        raise APIException(localization_key='error.progress_not_found', status_code=404)
-    stats = DeckService.get_statistics(db, current_user.id, deck)
-    return {"learned": progress.learned, "stats": stats}
+    learned = await DeckService.toggle_learned(db, current_user.id, deck, card)
+    stats = await DeckService.get_statistics(db, current_user.id, deck)
+    return {"learned": learned, "stats": stats}
+
+
+@router.put("/{deck_id}/progress", response_model=deck_schema.ProgressSyncResponse)
+async def sync_progress(deck_id: int, data: deck_schema.ProgressSync, db: AsyncSession = Depends(get_db),
+                        current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
+    if not deck:
+        raise APIException(localization_key='error.deck_not_found', status_code=404)
+    # operations are applied in order, so the last value sent for a card wins
+    updates = {update.card_id: update.learned for update in data.updates}
+    changed = await DeckService.set_progress(db, current_user.id, deck, updates) if updates else 0
+    stats = await DeckService.get_statistics(db, current_user.id, deck)
+    return {"changed": changed, "stats": stats}
+
+
+@router.post("/{deck_id}/reviews", response_model=deck_schema.ReviewsResponse)
+async def review_cards(deck_id: int, data: deck_schema.Reviews, db: AsyncSession = Depends(get_db),
+                       current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id, show_all=True)
+    if not deck:
+        raise APIException(localization_key='error.deck_not_found', status_code=404)
+    grades = {review.card_id: review.grade for review in data.reviews}
+    cards = await DeckService.review_cards(db, current_user.id, deck, grades) if grades else []
+    stats = await DeckService.get_statistics(db, current_user.id, deck)
+    return {"cards": cards, "stats": stats}
 
 
-@router.delete("/{deck_id}/reset")
-def reset_progress(deck_id: int, db: Session = Depends(get_db),
-                   current_user: User = Depends(get_current_user)):
-    deck = DeckService.get_user_deck(db, deck_id, current_user.id)
+@router.delete("/{deck_id}/reset", response_model=deck_schema.StatusResponse)
+async def reset_progress(deck_id: int, db: AsyncSession = Depends(get_db),
+                         current_user: Principal = Depends(get_current_user)):
+    deck = await DeckService.get_user_deck(db, deck_id, current_user.id)
     if not deck:
         raise APIException(localization_key='error.deck_not_found', status_code=404)
-    DeckService.reset_progress(db, current_user.id, deck)
+    await DeckService.reset_progress(db, current_user.id, deck)
     return {"status": True}
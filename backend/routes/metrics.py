@@ -0,0 +1,58 @@
+"""Metrics routes"""
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from auth import principal_cache, require_metrics_access
+from services import public_deck_cache
+from database import async_engine, pool_stats, WAIT_BUCKETS_MS
+import instrumentation
+
+
+# cache, pool and per-route counters describe other users' traffic, so neither router is public
+router = APIRouter(dependencies=[Depends(require_metrics_access)])
+prometheus_router = APIRouter(dependencies=[Depends(require_metrics_access)])
+
+
+@router.get("")
+async def get_metrics():
+    return {
+        "principal_cache": principal_cache.stats(),
+        "public_deck_cache": public_deck_cache.stats(),
+        "db_pool": pool_stats.stats(async_engine.pool)
+    }
+
+
+@prometheus_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_prometheus_metrics():
+    pool = pool_stats.stats(async_engine.pool)
+    lines = instrumentation.render()
+    lines += instrumentation.render_histogram(
+        "flashcards_db_pool_wait_seconds", "Time spent waiting for a database connection.",
+        [bound / 1000 for bound in WAIT_BUCKETS_MS], (), {(): (pool_stats.wait_counts, pool_stats.wait_sum_ms / 1000)}
+    )
+    lines += instrumentation.render_metric(
+        "flashcards_db_pool_checked_out", "gauge", "Database connections in use.", pool["checked_out"]
+    )
+    lines += instrumentation.render_metric(
+        "flashcards_db_pool_overflow", "gauge", "Database connections open beyond the pool size.", pool["overflow"]
+    )
+    lines += instrumentation.render_metric(
+        "flashcards_db_pool_timeouts_total", "counter", "Checkouts that gave up waiting.", pool["timeouts"]
+    )
+    for name, cache in (("principal", principal_cache), ("public_deck", public_deck_cache)):
+        stats = cache.stats()
+        lines += instrumentation.render_metric(
+            f"flashcards_{name}_cache_hits_total", "counter", f"Hits of the {name} cache.", stats["hits"]
+        )
+        lines += instrumentation.render_metric(
+            f"flashcards_{name}_cache_misses_total", "counter", f"Misses of the {name} cache.", stats["misses"]
+        )
+    stats = public_deck_cache.stats()
+    lines += instrumentation.render_metric(
+        "flashcards_public_deck_cache_bytes", "gauge", "Estimated memory held by the public deck cache.",
+        stats["bytes"]
+    )
+    lines += instrumentation.render_metric(
+        "flashcards_public_deck_cache_oversized_total", "counter", "Public decks too big to be cached.",
+        stats["oversized"]
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=instrumentation.PROMETHEUS_MEDIA_TYPE)
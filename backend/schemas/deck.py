@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, Field, field_serializer
 from typing import List, Optional
 
 
@@ -23,10 +24,133 @@ class Cards(BaseModel):
     cards: List[Card]
 
 
-class NextCard(BaseModel):
+class StudySessionCreate(BaseModel):
     mode: str
-    exclude: list[int]
+
+
+class NextCard(BaseModel):
+    session: str = Field(max_length=64)
+
+
+class NextCards(NextCard):
+    count: int = Field(10, ge=1, le=100)
 
 
 class ToggleLearned(BaseModel):
     card_id: int
+
+
+class ProgressUpdate(BaseModel):
+    card_id: int
+    learned: bool
+
+
+class ProgressSync(BaseModel):
+    updates: List[ProgressUpdate] = Field(max_length=10000)
+
+
+class Review(BaseModel):
+    card_id: int
+    grade: int = Field(ge=0, le=5)
+
+
+class Reviews(BaseModel):
+    reviews: List[Review] = Field(max_length=10000)
+
+
+class StatusResponse(BaseModel):
+    status: bool
+
+
+class DeckResponse(BaseModel):
+    id: int
+    name: str
+
+
+class CardsResponse(BaseModel):
+    cards: List[Card]
+
+
+class DeckCard(BaseModel):
+    id: int
+    entry: str
+    value: str
+
+
+class CardPageResponse(BaseModel):
+    cards: List[DeckCard]
+    next_cursor: Optional[int]
+    total: Optional[int] = None
+
+
+class SearchCard(BaseModel):
+    id: int
+    deck_id: int
+    entry: str
+    value: str
+
+
+class CardSearchResponse(BaseModel):
+    cards: List[SearchCard]
+    next_cursor: Optional[str]
+
+
+class StudyCard(BaseModel):
+    id: int
+    entry: str
+    value: str
+    learned: bool
+
+
+class SessionStats(BaseModel):
+    total: int
+    learned: int
+    remain: Optional[int]
+
+
+class DeckStats(BaseModel):
+    total: int
+    learned: int
+    due: int
+
+
+class SessionResponse(BaseModel):
+    session: str
+
+
+class NextCardResponse(BaseModel):
+    card: Optional[StudyCard]
+    stats: SessionStats
+    session: str
+
+
+class NextCardsResponse(BaseModel):
+    cards: List[StudyCard]
+    stats: SessionStats
+    session: str
+
+
+class ToggleLearnedResponse(BaseModel):
+    learned: bool
+    stats: DeckStats
+
+
+class ProgressSyncResponse(BaseModel):
+    changed: int
+    stats: DeckStats
+
+
+class ReviewedCard(BaseModel):
+    card_id: int
+    interval_days: int
+    due_at: datetime
+
+    @field_serializer("due_at")
+    def serialize_due_at(self, value: datetime) -> str:
+        # isoformat keeps "+00:00", the format the API always sent, where pydantic would write "Z"
+        return value.isoformat()
+
+
+class ReviewsResponse(BaseModel):
+    cards: List[ReviewedCard]
+    stats: DeckStats
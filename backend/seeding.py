@@ -0,0 +1,151 @@
+"""Synthetic data at production scale.
+
+Everything is bulk-loaded with COPY in batches over a single connection and one transaction.
+Ids come from blocks reserved on the tables' sequences, so cards and progress rows can
+reference their parents without reading anything back, and counters are written already
+correct instead of being rebuilt. Every user shares one password hash, computed once.
+Meant for a database nobody else is writing to.
+"""
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence
+from database import async_engine
+from models import Color, Language
+from auth import get_password_hash
+
+
+DISTRIBUTIONS = ("uniform", "pareto")
+# the 80/20 shape: most decks are small, a few are huge
+PARETO_ALPHA = 1.16
+
+
+@dataclass
+class SeedOptions:
+    users: int = 1000
+    decks_per_user: int = 5
+    min_cards: int = 20
+    max_cards: int = 2000
+    distribution: str = "pareto"
+    learned_ratio: float = 0.3
+    public_ratio: float = 0.05
+    public_learners: int = 3
+    password: str = "password"
+    batch_size: int = 50_000
+    random_seed: Optional[int] = None
+
+
+class _BatchCopy:
+    def __init__(self, connection, table: str, columns: Sequence[str], batch_size: int):
+        self.connection = connection
+        self.table = table
+        self.columns = columns
+        self.batch_size = batch_size
+        self.records = []
+        self.rows = 0
+
+    async def add(self, record: tuple):
+        self.records.append(record)
+        if len(self.records) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        if self.records:
+            await self.connection.copy_records_to_table(self.table, records=self.records, columns=self.columns)
+            self.rows += len(self.records)
+            self.records = []
+
+
+async def _reserve_ids(connection, table: str, count: int) -> int:
+    # moves the sequence past a block of count ids at once and returns the first one
+    return await connection.fetchval(
+        "SELECT setval(pg_get_serial_sequence($1, 'id'), nextval(pg_get_serial_sequence($1, 'id')) + $2 - 1)"
+        " - $2 + 1",
+        table, max(count, 1)
+    )
+
+
+def _deck_sizes(options: SeedOptions, rng: random.Random) -> List[int]:
+    sizes = []
+    for _ in range(options.users * options.decks_per_user):
+        if options.distribution == "pareto":
+            size = int(options.min_cards * rng.paretovariate(PARETO_ALPHA))
+        else:
+            size = rng.randint(options.min_cards, options.max_cards)
+        sizes.append(min(size, options.max_cards))
+    return sizes
+
+
+async def seed(options: SeedOptions) -> dict:
+    rng = random.Random(options.random_seed)
+    start = time.perf_counter()
+    tag = f"seed{time.time_ns()}"
+    hashed_password = get_password_hash(options.password)
+    sizes = _deck_sizes(options, rng)
+    owners = [None if rng.random() < options.public_ratio else index // options.decks_per_user
+              for index in range(len(sizes))]
+    now = datetime.now(timezone.utc)
+    async with async_engine.connect() as sa_connection:
+        connection = (await sa_connection.get_raw_connection()).driver_connection
+        async with connection.transaction():
+            first_user = await _reserve_ids(connection, "users", options.users)
+            first_deck = await _reserve_ids(connection, "decks", len(sizes))
+            first_card = await _reserve_ids(connection, "cards", sum(sizes))
+
+            users = _BatchCopy(connection, "users", ("id", "username", "email", "color", "language",
+                                                     "hashed_password"), options.batch_size)
+            for index in range(options.users):
+                await users.add((first_user + index, f"{tag}-{index}", f"{tag}-{index}@example.com",
+                                 int(Color.YELLOW), int(Language.EN), hashed_password))
+            await users.flush()
+
+            decks = _BatchCopy(connection, "decks", ("id", "name", "user_id", "card_count", "version"),
+                               options.batch_size)
+            for index, (size, owner) in enumerate(zip(sizes, owners)):
+                user_id = None if owner is None else first_user + owner
+                await decks.add((first_deck + index, f"deck {index}", user_id, size, 1))
+            await decks.flush()
+
+            cards = _BatchCopy(connection, "cards", ("id", "deck_id", "entry", "value"), options.batch_size)
+            card_id = first_card
+            for index, size in enumerate(sizes):
+                for position in range(size):
+                    await cards.add((card_id, first_deck + index, f"entry {index}-{position}", f"value {position}"))
+                    card_id += 1
+            await cards.flush()
+
+            progress = _BatchCopy(connection, "user_progress", (
+                "user_id", "deck_id", "card_id", "learned", "interval_days", "ease", "repetitions", "due_at"
+            ), options.batch_size)
+            counters = _BatchCopy(connection, "deck_progress", ("user_id", "deck_id", "learned"),
+                                  options.batch_size)
+            deck_card = first_card
+            for index, (size, owner) in enumerate(zip(sizes, owners)):
+                if owner is None:
+                    learners = rng.sample(range(options.users), min(options.public_learners, options.users))
+                else:
+                    learners = [owner]
+                learned = round(size * options.learned_ratio)
+                for learner in learners:
+                    for position in rng.sample(range(size), learned):
+                        interval = rng.randint(1, 30)
+                        # scheduled from a week overdue to a month ahead
+                        due_at = now + timedelta(days=rng.randint(-7, 30), seconds=rng.randint(0, 86399))
+                        await progress.add((first_user + learner, first_deck + index, deck_card + position, True,
+                                            interval, round(rng.uniform(1.3, 3.0), 2), rng.randint(1, 8), due_at))
+                    await counters.add((first_user + learner, first_deck + index, learned))
+                deck_card += size
+            await progress.flush()
+            await counters.flush()
+        await sa_connection.exec_driver_sql("ANALYZE users, decks, cards, user_progress, deck_progress")
+        await sa_connection.commit()
+    return {
+        "users": users.rows,
+        "decks": decks.rows,
+        "cards": cards.rows,
+        "user_progress": progress.rows,
+        "deck_progress": counters.rows,
+        "seconds": round(time.perf_counter() - start, 1),
+        "username_prefix": tag
+    }
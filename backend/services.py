@@ -1,258 +1,783 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-import pandas as pd
-import io
-from fastapi import File
-from models import User, Deck, Card, UserProgress, StudyMode, COLOR_MAP, LANGUAGE_MAP
-from auth import get_password_hash
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import (select, update, delete, func, and_, or_, all_, any_, literal, null, true, union_all, tuple_,
+                        Integer, Boolean, Float, DateTime, Text)
+from sqlalchemy.dialects.postgresql import insert, aggregate_order_by, ARRAY
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from array import array
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterator, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import random
+import sys
+import uuid
+from models import (User, Deck, Card, UserProgress, DeckProgress, StudySession, StudySessionChunk, StudyMode,
+                    COLOR_MAP, LANGUAGE_MAP, SESSION_CHUNK_SIZE, SHUFFLE_KEY_RANGE)
+from auth import hash_password, principal_cache
+from cache import VersionedCache
+from config import settings
+from database import AsyncSessionLocal
 from schemas import auth as auth_schema
+import spreadsheet
+
+
+IMPORT_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
+DUE_SESSION_SIZE = 500
+NEW_CARDS_PER_SESSION = 20
+PURGE_BATCH_SIZE = 1000
+# bigger shuffled sessions are walked along ix_cards_deck_shuffle instead of snapshotted; at least this
+# many eligible cards keep a walk from reading far past the cards its mode skips
+SESSION_SNAPSHOT_LIMIT = 1000
+PUBLIC_SESSION = "public"
+
+
+@dataclass(frozen=True)
+class PublicDeck:
+    """Cards of a public deck in id order, held as flat arrays rather than ORM objects"""
+    id: int
+    name: str
+    version: int
+    card_ids: array
+    entries: Tuple[str, ...]
+    values: Tuple[str, ...]
+
+    @property
+    def card_count(self) -> int:
+        return len(self.card_ids)
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self.card_ids) + sys.getsizeof(self.entries) + sys.getsizeof(self.values)
+                + sum(map(sys.getsizeof, self.entries)) + sum(map(sys.getsizeof, self.values)))
+
+
+public_deck_cache = VersionedCache(
+    maxsize=settings.PUBLIC_DECK_CACHE_SIZE, ttl=settings.PUBLIC_DECK_CACHE_TTL_SECONDS, sizeof=PublicDeck.nbytes,
+    maxbytes=settings.PUBLIC_DECK_CACHE_MAX_BYTES
+)
+
 
 class UserService:
     @classmethod
-    def create_user(cls, db: Session, user_data: auth_schema.UserCreate):
+    async def create_user(cls, db: AsyncSession, user_data: auth_schema.UserCreate):
         user = User(
             username=user_data.username,
             email=user_data.email,
-            hashed_password=get_password_hash(user_data.password),
+            hashed_password=await hash_password(user_data.password),
             color=COLOR_MAP.get(user_data.color),
             language=LANGUAGE_MAP.get(user_data.language)
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return user
 
     @classmethod
-    def update_user(cls, db: Session, user_id: int, user_data: auth_schema.UserUpdate):
-        user = db.query(User).filter(User.id == user_id).first()
+    async def update_user(cls, db: AsyncSession, user_id: int, user_data: auth_schema.UserUpdate):
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             return None
         if user_data.color is not None:
             user.color = COLOR_MAP[user_data.color]
         if user_data.language is not None:
             user.language = LANGUAGE_MAP[user_data.language]
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        principal_cache.pop(user.username)
         return user
 
 
 class DeckService:
     @staticmethod
-    def get_user_deck(db: Session, deck_id: int, user_id: int = None, show_all: bool = False):
-        base_query = db.query(Deck).filter(Deck.id == deck_id)
+    async def get_user_deck(db: AsyncSession, deck_id: int, user_id: int = None, show_all: bool = False):
+        base_query = select(Deck).where(Deck.id == deck_id)
         if show_all:
-            base_query = base_query.filter((Deck.user_id.is_(None)) | (Deck.user_id == user_id))
+            base_query = base_query.where((Deck.user_id.is_(None)) | (Deck.user_id == user_id))
         elif user_id is None:
-            base_query = base_query.filter(Deck.user_id.is_(None))
+            base_query = base_query.where(Deck.user_id.is_(None))
         else:
-            base_query = base_query.filter(Deck.user_id == user_id)
-        deck = base_query.first()
+            base_query = base_query.where(Deck.user_id == user_id)
+        deck = await db.scalar(base_query)
         if not deck:
             return None
         return deck
 
     @staticmethod
-    def get_user_decks(db: Session, user_id: int = None, show_all: bool = False):
-        base_query = db.query(Deck)
+    def _visible_decks(stmt, user_id: int = None, show_all: bool = False):
         if show_all:
-            base_query = base_query.filter((Deck.user_id.is_(None) | (Deck.user_id == user_id)))
+            return stmt.where((Deck.user_id.is_(None) | (Deck.user_id == user_id)))
         elif user_id is None:
-            base_query = base_query.filter(Deck.user_id.is_(None))
-        else:
-            base_query = base_query.filter(Deck.user_id == user_id)
-        decks = base_query.all()
+            return stmt.where(Deck.user_id.is_(None))
+        return stmt.where(Deck.user_id == user_id)
+
+    @staticmethod
+    async def get_user_decks(db: AsyncSession, user_id: int = None, show_all: bool = False,
+                             limit: int = None, after: int = None):
+        """(id, name, version) rows in id order, one keyset page when limit is given"""
+        base_query = DeckService._visible_decks(
+            select(Deck.id, Deck.name, Deck.version), user_id, show_all
+        ).order_by(Deck.id)
+        if after is not None:
+            base_query = base_query.where(Deck.id > after)
+        if limit is not None:
+            base_query = base_query.limit(limit)
+        decks = (await db.execute(base_query)).all()
         return decks
 
     @staticmethod
-    def create_deck(db: Session, name: str, user_id: int):
+    async def count_user_decks(db: AsyncSession, user_id: int = None, show_all: bool = False):
+        return await db.scalar(DeckService._visible_decks(select(func.count(Deck.id)), user_id, show_all))
+
+    @staticmethod
+    async def create_deck(db: AsyncSession, name: str, user_id: int):
         deck = Deck(name=name, user_id=user_id)
         db.add(deck)
-        db.commit()
-        db.refresh(deck)
+        await db.commit()
+        await db.refresh(deck)
         return deck
 
     @staticmethod
-    def update_deck(db: Session, deck: Deck, name: str):
+    async def update_deck(db: AsyncSession, deck: Deck, name: str):
         deck.name = name
-        db.commit()
-        db.refresh(deck)
+        deck.version = Deck.version + 1
+        public_deck_cache.pop(deck.id)
+        await db.commit()
+        await db.refresh(deck)
         return deck
 
     @staticmethod
-    def delete_deck(db: Session, deck: Deck):
-        db.delete(deck)
-        db.commit()
+    async def bump_version(db: AsyncSession, deck_id: int):
+        await db.execute(update(Deck).where(Deck.id == deck_id).values(version=Deck.version + 1))
+        # other workers notice the new version when their copy is revalidated
+        public_deck_cache.pop(deck_id)
+
+    @staticmethod
+    async def delete_deck(db: AsyncSession, deck: Deck):
+        # cards and progress go with the foreign key cascades
+        await db.execute(delete(Deck).where(Deck.id == deck.id))
+        public_deck_cache.pop(deck.id)
+        await db.commit()
         return True
 
     @staticmethod
-    def get_deck_cards(db: Session, deck: Deck):
-        cards = db.query(Card).filter(Card.deck_id == deck.id).all()
+    async def get_deck_cards(db: AsyncSession, deck: Deck, limit: int = None, after: int = None):
+        """(id, entry, value) rows in id order along ix_cards_deck_id_id, one keyset page when limit is given"""
+        base_query = select(Card.id, Card.entry, Card.value).where(Card.deck_id == deck.id).order_by(Card.id)
+        if after is not None:
+            base_query = base_query.where(Card.id > after)
+        if limit is not None:
+            base_query = base_query.limit(limit)
+        cards = (await db.execute(base_query)).all()
         return cards
 
     @staticmethod
-    def get_deck_card(db: Session, deck: Deck, card_id: int):
-        card = db.query(Card).filter(Card.deck_id == deck.id, Card.id == card_id).first()
+    async def get_deck_card(db: AsyncSession, deck: Deck, card_id: int):
+        card = await db.scalar(select(Card).where(Card.deck_id == deck.id, Card.id == card_id))
         return card
 
     @staticmethod
-    def update_deck_cards(db: Session, deck: Deck, cards_data: list, replace: bool = False):
-        if replace:
-            cards_to_delete = db.query(Card).filter(Card.deck_id == deck.id).all()
-            for card in cards_to_delete:
-                db.delete(card)
-            for card_data in cards_data:
-                card = Card(entry=card_data.entry, value=card_data.value, deck_id=deck.id)
-                db.add(card)
+    def card_search_filter(query: str):
+        """entry/value ILIKE '%query%', which the trigram indexes answer from three characters on"""
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return or_(Card.entry.ilike(pattern), Card.value.ilike(pattern))
+
+    @staticmethod
+    def _search_cards_statement(query: str, user_id: int = None, deck: Deck = None,
+                                limit: int = None, after: Tuple[float, int] = None):
+        candidates = select(Card.id, Card.deck_id, Card.entry, Card.value).where(DeckService.card_search_filter(query))
+        if deck is not None:
+            candidates = candidates.where(Card.deck_id == deck.id)
         else:
-            existing_cards = db.query(Card).filter(Card.deck_id == deck.id).all()
-            existing_dict = {card.entry: card for card in existing_cards}
-            new_entries = {card_data.entry for card_data in cards_data}
-            for card in existing_cards:
-                if card.entry not in new_entries:
-                    db.delete(card)
-            for card_data in cards_data:
-                entry = card_data.entry
-                if entry in existing_dict:
-                    existing_dict[entry].value = card_data.value
-                else:
-                    card = Card(entry=entry, value=card_data.value, deck_id=deck.id)
-                    db.add(card)
-        db.commit()
-        cards = db.query(Card).filter(Card.deck_id == deck.id).all()
+            # an array of the visible decks, not a join: the planner underrates what ILIKE costs per row and
+            # would rather test every card of the table than only the cards of these decks
+            visible = DeckService._visible_decks(select(Deck.id), user_id, show_all=True)
+            candidates = candidates.where(Card.deck_id == any_(func.array(visible.scalar_subquery())))
+        candidates = candidates.subquery()
+        rank = func.greatest(func.word_similarity(query, candidates.c.entry),
+                             func.word_similarity(query, candidates.c.value))
+        base_query = select(candidates, rank.label("rank")).order_by(rank.desc(), candidates.c.id)
+        if after is not None:
+            base_query = base_query.where(or_(rank < after[0], and_(rank == after[0], candidates.c.id > after[1])))
+        if limit is not None:
+            base_query = base_query.limit(limit)
+        return base_query
+
+    @staticmethod
+    async def search_cards(db: AsyncSession, query: str, user_id: int = None, deck: Deck = None,
+                           limit: int = None, after: Tuple[float, int] = None):
+        """(id, deck_id, entry, value, rank) rows of the decks the user can see (or of one deck),
+        best match first; `after` is the (rank, id) of the last row of the previous page"""
+        stmt = DeckService._search_cards_statement(query, user_id, deck, limit, after)
+        cards = (await db.execute(stmt)).all()
         return cards
 
     @staticmethod
-    def export_cards(db: Session, deck: Deck):
-        cards = DeckService.get_deck_cards(db, deck)
-        df = pd.DataFrame([
-            {"entry": card.entry, "value": card.value} for card in cards
-        ])
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name=deck.name, index=False)
-        output.seek(0)
-        filename = f"{deck.name}_cards.xlsx"
-        return output, filename
-
-    @staticmethod
-    def read_excel_cards(file: File):
-        contents = file.file.read()
-        df = pd.read_excel(io.BytesIO(contents))
-        required_columns = ['entry', 'value']
-        if not all(col in df.columns for col in required_columns):
-            return "error.excel_columns"
-        cards_data = []
-        for _, row in df.iterrows():
-            if pd.notna(row['entry']) and pd.notna(row['value']):
-                cards_data.append({
-                    "entry": str(row['entry']).strip(),
-                    "value": str(row['value']).strip()
-                })
-        return cards_data
-
-    @staticmethod
-    def get_next_card(db: Session, user_id: int, deck: Deck, mode: str, exclude: list):
-        base_query = db.query(Card).filter(
-            Card.deck_id == deck.id,
+    def _upsert_cards_statement(deck: Deck, values: dict):
+        new = func.unnest(
+            literal(list(values), ARRAY(Text)),
+            literal(list(values.values()), ARRAY(Text))
+        ).table_valued("entry", "value").render_derived()
+        stmt = insert(Card).from_select(
+            ["deck_id", "entry", "value"],
+            select(literal(deck.id), new.c.entry, new.c.value)
         )
-        if exclude:
-            base_query = base_query.filter(Card.id.notin_(exclude))
-        if mode == StudyMode.LEARNED.value:
-            cards = base_query.join(UserProgress).filter(
-                UserProgress.user_id == user_id,
-                UserProgress.learned.is_(True)
+        return stmt.on_conflict_do_update(
+            index_elements=[Card.deck_id, Card.entry],
+            set_={"value": stmt.excluded.value}
+        )
+
+    @staticmethod
+    async def update_deck_cards(db: AsyncSession, deck: Deck, cards_data: list, replace: bool = False):
+        """Make the deck hold exactly `cards_data` with a set-based diff: one DELETE of the entries
+        that are gone (every card in replace mode) and one upsert of the rest"""
+        values = {card_data.entry: card_data.value for card_data in cards_data}
+        removed = delete(Card).where(Card.deck_id == deck.id)
+        if not replace:
+            removed = removed.where(Card.entry != all_(literal(list(values), ARRAY(Text))))
+        await db.execute(removed)
+        stmt = DeckService._upsert_cards_statement(deck, values).returning(Card.entry, Card.value)
+        cards = (await db.execute(stmt)).all()
+        await DeckService.rebuild_counters(db, deck.id)
+        await DeckService.bump_version(db, deck.id)
+        await db.commit()
+        await db.refresh(deck)
+        return cards
+
+    @staticmethod
+    async def import_cards(db: AsyncSession, deck: Deck, cards: Iterator[Tuple[str, str]]):
+        """Replace the deck's cards with a stream of (entry, value) pairs, written in batches
+        so memory stays bounded by the batch size whatever the upload size"""
+        await db.execute(delete(Card).where(Card.deck_id == deck.id))
+        while True:
+            # pulling the next batch parses the upload, keep that off the event loop
+            batch = await run_in_threadpool(list, islice(cards, IMPORT_BATCH_SIZE))
+            if not batch:
+                break
+            await db.execute(DeckService._upsert_cards_statement(deck, dict(batch)))
+        await DeckService.rebuild_counters(db, deck.id)
+        await DeckService.bump_version(db, deck.id)
+        await db.commit()
+        await db.refresh(deck)
+
+    @staticmethod
+    def export_cards(deck: Deck, export_format: str):
+        filename = f"{deck.name}_cards.{export_format}"
+        return DeckService._export_stream(deck, export_format), filename
+
+    @staticmethod
+    async def _export_stream(deck: Deck, export_format: str):
+        """Yield the export as it is produced: rows come from a server-side cursor in
+        EXPORT_BATCH_SIZE partitions and are encoded off the event loop"""
+        writer = spreadsheet.writer(export_format, deck.name)
+        yield writer.header()
+        # the response outlives the request's session, so the stream has its own
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(Card.entry, Card.value).where(Card.deck_id == deck.id).order_by(Card.id)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
             )
-            remain = cards.count()
-            card = cards.order_by(func.random()).first()
-        elif mode == StudyMode.UNLEARNED.value:
-            subquery = db.query(UserProgress.card_id).filter(
+            async for rows in result.partitions():
+                chunk = await run_in_threadpool(writer.write, rows)
+                if chunk:
+                    yield chunk
+        async for chunk in iterate_in_threadpool(writer.finish()):
+            yield chunk
+
+    @staticmethod
+    def _new_cards_statement(deck: Deck, user_id: int):
+        """Cards never reviewed have no schedule yet, a quota of them joins every due session in id order.
+        The anti-join streams along ix_cards_deck_id_id and stops at the quota instead of reading the deck."""
+        scheduled = select(UserProgress.id).where(
+            UserProgress.card_id == Card.id,
+            UserProgress.user_id == user_id,
+            UserProgress.due_at.isnot(None)
+        )
+        return select(Card.id).where(
+            Card.deck_id == deck.id,
+            ~scheduled.exists()
+        ).order_by(Card.id).limit(NEW_CARDS_PER_SESSION)
+
+    @staticmethod
+    def _session_cards_statement(deck: Deck, user_id: int = None, mode: str = None):
+        """Array of the card ids of a new snapshotted session in study order: shuffled for users, by id for guests"""
+        if user_id is None:
+            return select(func.array_agg(aggregate_order_by(Card.id, Card.id))).where(Card.deck_id == deck.id)
+        if mode == StudyMode.DUE.value:
+            # range seek on ix_user_progress_due, most overdue first; no sort over the whole deck
+            scheduled = select(UserProgress.card_id, UserProgress.due_at).where(
+                UserProgress.user_id == user_id,
+                UserProgress.deck_id == deck.id,
+                UserProgress.due_at <= func.now()
+            ).order_by(UserProgress.due_at).limit(DUE_SESSION_SIZE)
+            unscheduled = DeckService._new_cards_statement(deck, user_id).add_columns(null().label("due_at"))
+            due = union_all(scheduled, unscheduled).subquery()
+            # overdue cards first, new ones (NULL due_at sorts last) after them
+            return select(func.array_agg(aggregate_order_by(due.c.card_id, due.c.due_at, due.c.card_id)))
+        stmt = select(Card.id).where(Card.deck_id == deck.id)
+        if mode == StudyMode.LEARNED.value:
+            # plain `learned` and the deck id let the planner walk the partial ix_user_progress_learned
+            stmt = stmt.join(UserProgress, and_(
+                UserProgress.card_id == Card.id,
                 UserProgress.user_id == user_id,
                 UserProgress.deck_id == deck.id,
-                UserProgress.learned.is_(True)
+                UserProgress.learned
+            ))
+        elif mode == StudyMode.UNLEARNED.value:
+            stmt = stmt.outerjoin(UserProgress, and_(
+                UserProgress.card_id == Card.id,
+                UserProgress.user_id == user_id
+            )).where(UserProgress.learned.isnot(True))
+        # the same order a walk reads, from a random key to the end of ix_cards_deck_shuffle and wrapped
+        # round to it; sorts at most SESSION_SNAPSHOT_LIMIT learned or unlearned cards
+        start = random.randrange(SHUFFLE_KEY_RANGE)
+        legs = [stmt.where(shuffle_range).order_by(Card.shuffle_key, Card.id)
+                for shuffle_range in (Card.shuffle_key >= start, Card.shuffle_key < start)]
+        return select(func.array_cat(*(func.array(leg.scalar_subquery()) for leg in legs)))
+
+    @staticmethod
+    async def start_session(db: AsyncSession, deck: Deck, user_id: int = None, mode: str = None):
+        """Start a session on a deck and return its token. Sessions of more than SESSION_SNAPSHOT_LIMIT
+        shuffled cards store where their walk starts, the others snapshot their cards."""
+        session_id = uuid.uuid4().hex
+        size = None
+        if user_id is not None and mode != StudyMode.DUE.value:
+            learned = 0
+            if mode != StudyMode.ALL.value:
+                learned = await db.scalar(select(DeckProgress.learned).where(
+                    DeckProgress.user_id == user_id,
+                    DeckProgress.deck_id == deck.id
+                )) or 0
+            size = {
+                StudyMode.ALL.value: deck.card_count,
+                StudyMode.LEARNED.value: learned,
+                StudyMode.UNLEARNED.value: deck.card_count - learned
+            }[mode]
+        if size is not None and size > SESSION_SNAPSHOT_LIMIT:
+            start = random.randrange(SHUFFLE_KEY_RANGE)
+            db.add(StudySession(id=session_id, user_id=user_id, deck_id=deck.id, size=size, mode=mode,
+                                start_key=start))
+            await db.commit()
+            # walk tokens carry the leg they are in and the (shuffle_key, id) cursor in it, ids start at 1
+            return f"{session_id}:0:0:{start}:0"
+        picked = select(func.coalesce(
+            DeckService._session_cards_statement(deck, user_id, mode).scalar_subquery(),
+            literal([], ARRAY(Integer))
+        ).label("card_ids")).cte("picked")
+        size = func.cardinality(picked.c.card_ids)
+        session = insert(StudySession).from_select(
+            ["id", "user_id", "deck_id", "size"],
+            select(literal(session_id), literal(user_id, Integer), literal(deck.id), size)
+        ).returning(StudySession.id).cte("session")
+        # the session row and its chunks in one statement; the foreign key is checked at its end
+        last_chunk = (size + SESSION_CHUNK_SIZE - 1) // SESSION_CHUNK_SIZE - 1
+        chunks = func.generate_series(0, last_chunk).table_valued("chunk").render_derived()
+        start = chunks.c.chunk * SESSION_CHUNK_SIZE
+        await db.execute(insert(StudySessionChunk).from_select(
+            ["session_id", "chunk", "card_ids"],
+            select(session.c.id, chunks.c.chunk, picked.c.card_ids[start + 1:start + SESSION_CHUNK_SIZE]).select_from(
+                picked.join(session, true()).join(chunks, true())
             )
-            cards = base_query.filter(
-                ~Card.id.in_(subquery)
+        ))
+        await db.commit()
+        return f"{session_id}:0"
+
+    @staticmethod
+    async def purge_sessions(db: AsyncSession, batch_size: int = PURGE_BATCH_SIZE) -> int:
+        """Delete the sessions older than STUDY_SESSION_TTL_HOURS, oldest first and one batch per
+        transaction so no lock is held for long; returns how many went"""
+        purged = 0
+        while True:
+            expired = select(StudySession.id).where(
+                StudySession.created_at < func.now() - timedelta(hours=settings.STUDY_SESSION_TTL_HOURS)
+            ).order_by(StudySession.created_at).limit(batch_size)
+            # chunks go with the foreign key cascade
+            deleted = len((await db.execute(
+                delete(StudySession).where(StudySession.id.in_(expired.scalar_subquery())).returning(StudySession.id)
+            )).all())
+            await db.commit()
+            purged += deleted
+            if deleted < batch_size:
+                return purged
+
+    @staticmethod
+    def _snapshot_step(session_id: str, deck: Deck, user_id: int, learned, position: int, count: int):
+        """The next `count` cards still in the deck, walking the chunks from the current one in order; ids of
+        deleted cards drop out in the join, so a slice of them costs no extra round trip"""
+        ids = func.unnest(StudySessionChunk.card_ids).table_valued(
+            "card_id", with_ordinality="ordinality"
+        ).render_derived()
+        slot = StudySessionChunk.chunk * SESSION_CHUNK_SIZE + ids.c.ordinality
+        # one primary key lookup per id; the LIMIT keeps the planner from flattening it into a join that hashes
+        # the whole deck when its statistics are behind
+        card = select(Card.id, Card.entry, Card.value).where(
+            Card.id == ids.c.card_id,
+            Card.deck_id == deck.id
+        ).limit(1).lateral()
+        picked = select(
+            card.c.id, card.c.entry, card.c.value,
+            learned.label("learned"),
+            slot.label("slot")
+        ).select_from(StudySessionChunk).join(ids, true()).join(card, true())
+        if user_id is not None:
+            picked = picked.outerjoin(UserProgress, and_(
+                UserProgress.card_id == card.c.id,
+                UserProgress.user_id == user_id
+            ))
+        return picked.where(
+            StudySessionChunk.session_id == session_id,
+            StudySessionChunk.chunk >= position // SESSION_CHUNK_SIZE,
+            slot > position
+        ).order_by(StudySessionChunk.chunk, ids.c.ordinality).limit(count)
+
+    @staticmethod
+    def _walk_step(session_id: str, deck: Deck, user_id: int, learned, cursor: Tuple[int, int, int], count: int):
+        """The next `count` cards of the session's mode along ix_cards_deck_shuffle after the cursor: the
+        leg from the start key up, then the one below it. Cards the mode skips are read past, the live
+        learned flags decide"""
+        leg, key, card_id = cursor
+        start, mode = (select(column).where(StudySession.id == session_id).scalar_subquery()
+                       for column in (StudySession.start_key, StudySession.mode))
+        after = tuple_(Card.shuffle_key, Card.id) > tuple_(key, card_id)
+        # a cursor in the first leg never lies below the start key, so it alone bounds the index scan there
+        legs = [(0, after), (1, and_(Card.shuffle_key < start, after) if leg == 1 else Card.shuffle_key < start)]
+        steps = []
+        for index, shuffle_range in legs[leg:]:
+            step = select(
+                Card.id, Card.entry, Card.value,
+                learned.label("learned"),
+                literal(index).label("leg"), Card.shuffle_key
+            ).outerjoin(UserProgress, and_(
+                UserProgress.card_id == Card.id,
+                UserProgress.user_id == user_id
+            )).where(
+                Card.deck_id == deck.id,
+                shuffle_range,
+                or_(mode == StudyMode.ALL.value, learned == (mode == StudyMode.LEARNED.value))
             )
-            remain = cards.count()
-            card = cards.order_by(func.random()).first()
+            steps.append(step.order_by(Card.shuffle_key, Card.id).limit(count))
+        return union_all(*steps)
+
+    @staticmethod
+    async def get_next_cards(db: AsyncSession, user_id: int, deck: Deck, session: str, count: int):
+        """Return the next `count` cards of a session, one stats snapshot and the advanced token.
+
+        None is returned for an unknown or foreign session token.
+        """
+        # snapshot tokens are `id:position`, walk tokens `id:seen:leg:key:card_id`
+        session_id, *fields = session.split(":")
+        if len(fields) not in (1, 4) or not all(field.isdigit() for field in fields):
+            return None
+        position, *cursor = map(int, fields)
+        walk = bool(cursor)
+        if walk and (user_id is None or cursor[0] > 1):
+            return None
+        if user_id is not None:
+            # no progress row means not learned
+            learned = func.coalesce(UserProgress.learned, False)
+            learned_total = func.coalesce(select(DeckProgress.learned).where(
+                DeckProgress.user_id == user_id,
+                DeckProgress.deck_id == deck.id
+            ).scalar_subquery(), 0)
         else:
-            cards = base_query
-            remain = cards.count()
-            card = cards.order_by(func.random()).first()
-        if not card:
-            return None, None
-        progress = db.query(UserProgress).filter(
-            UserProgress.user_id == user_id,
-            UserProgress.card_id == card.id
-        ).first()
-        if not progress:
-            progress = UserProgress(user_id=user_id, deck_id=deck.id, card_id=card.id, learned=False)
-            db.add(progress)
-            db.commit()
-            db.refresh(progress)
-        progress_card = {
-            "id": progress.card_id,
-            "entry": progress.card.entry,
-            "value": progress.card.value,
-            "learned": progress.learned
-        }
-        return progress_card, remain - 1
+            learned = literal(False)
+            learned_total = literal(0)
+        if walk:
+            picked = DeckService._walk_step(session_id, deck, user_id, learned, cursor, count).subquery()
+            order = (picked.c.leg, picked.c.shuffle_key, picked.c.id)
+        else:
+            picked = DeckService._snapshot_step(session_id, deck, user_id, learned, position, count).subquery()
+            order = (picked.c.slot,)
+        state = select(StudySession.size, learned_total.label("total_learned")).where(
+            StudySession.id == session_id,
+            StudySession.deck_id == deck.id,
+            StudySession.user_id.is_not_distinct_from(user_id)
+        ).subquery()
+        # one row with empty card columns once the session is exhausted, none for an unknown session
+        rows = (await db.execute(
+            select(state, picked).select_from(state.outerjoin(picked, true())).order_by(*order).limit(count)
+        )).all()
+        if not rows:
+            return None
+        size = rows[0].size
+        stats = {"total": deck.card_count, "learned": rows[0].total_learned}
+        if rows[0].id is None:
+            stats["remain"] = None
+            return [], stats, session if walk else f"{session_id}:{size}"
+        cards = [{
+            "id": row.id,
+            "entry": row.entry,
+            "value": row.value,
+            "learned": row.learned
+        } for row in rows]
+        last = rows[-1]
+        if walk:
+            # a walk's size was counted when it started, cards added or learned since move its end
+            position += len(rows)
+            stats["remain"] = max(size - position, 0)
+            return cards, stats, f"{session_id}:{position}:{last.leg}:{last.shuffle_key}:{last.id}"
+        # a short slice means the walk reached the end of the session
+        position = last.slot if len(rows) == count else size
+        stats["remain"] = size - position
+        return cards, stats, f"{session_id}:{position}"
 
     @staticmethod
-    def get_next_guest_card(db: Session, deck: Deck, exclude: list):
-        base_query = db.query(Card).filter(
-            Card.deck_id == deck.id,
+    async def get_next_card(db: AsyncSession, user_id: int, deck: Deck, session: str):
+        result = await DeckService.get_next_cards(db, user_id, deck, session, 1)
+        if result is None:
+            return None
+        cards, stats, session = result
+        return (cards[0] if cards else None), stats, session
+
+    @staticmethod
+    async def get_public_deck(db: AsyncSession, deck_id: int) -> Optional[PublicDeck]:
+        """Public deck from the process cache; a database hit only to revalidate its version or to load it"""
+        deck, expired = public_deck_cache.get(deck_id)
+        if deck is not None and not expired:
+            return deck
+        public = and_(Deck.id == deck_id, Deck.user_id.is_(None))
+        if deck is not None:
+            version = await db.scalar(select(Deck.version).where(public))
+            if public_deck_cache.revalidate(deck_id, version):
+                return deck
+        # the version is read before the cards: a concurrent edit then only makes the copy look older than it is
+        row = (await db.execute(select(Deck.id, Deck.name, Deck.version).where(public))).first()
+        if row is None:
+            return None
+        cards = (await db.execute(
+            select(Card.id, Card.entry, Card.value).where(Card.deck_id == deck_id).order_by(Card.id)
+        )).all()
+        deck = PublicDeck(
+            id=row.id,
+            name=row.name,
+            version=row.version,
+            card_ids=array("q", (card.id for card in cards)),
+            entries=tuple(card.entry for card in cards),
+            values=tuple(card.value for card in cards)
         )
-        if exclude:
-            base_query = base_query.filter(Card.id.notin_(exclude))
-        cards = base_query
-        remain = cards.count()
-        card = cards.order_by(Card.id).first()
-        if not card:
-            return None, None
-        progress_card = {
-            "id": card.id,
-            "entry": card.entry,
-            "value": card.value,
+        public_deck_cache.set(deck_id, deck.version, deck)
+        return deck
+
+    @staticmethod
+    def get_next_public_cards(deck: PublicDeck, session: str, count: int):
+        """Guest counterpart of get_next_cards, answered from the cached deck. Guests study in id
+        order, so the session token only needs the position."""
+        name, _, position = session.partition(":")
+        if name != PUBLIC_SESSION or not position.isdigit():
+            return None
+        start = min(int(position), deck.card_count)
+        end = min(start + count, deck.card_count)
+        cards = [{
+            "id": deck.card_ids[index],
+            "entry": deck.entries[index],
+            "value": deck.values[index],
             "learned": False
+        } for index in range(start, end)]
+        stats = {
+            "total": deck.card_count,
+            "learned": 0,
+            "remain": deck.card_count - end if cards else None
         }
-        return progress_card, remain - 1
+        return cards, stats, f"{PUBLIC_SESSION}:{end}"
 
     @staticmethod
-    def toggle_learned(db: Session, user_id: int, deck: Deck, card: Card):
-        progress = db.query(UserProgress).filter(
-            UserProgress.user_id == user_id,
-            UserProgress.deck_id == deck.id,
-            UserProgress.card_id == card.id
-        ).first()
-        if not progress:
-            return None
-        progress.learned = not progress.learned
-        db.commit()
-        db.refresh(progress)
-        return progress
+    async def toggle_learned(db: AsyncSession, user_id: int, deck: Deck, card: Card):
+        """Flip the learned flag of a card and return the new value; a missing row counts as not learned"""
+        stmt = insert(UserProgress).values(user_id=user_id, deck_id=deck.id, card_id=card.id, learned=True)
+        learned = await db.scalar(stmt.on_conflict_do_update(
+            index_elements=[UserProgress.user_id, UserProgress.card_id],
+            set_={"learned": UserProgress.learned.isnot(True)}
+        ).returning(UserProgress.learned))
+        await DeckService._add_learned(db, user_id, deck.id, 1 if learned else -1)
+        await db.commit()
+        return learned
+
+    @staticmethod
+    async def set_progress(db: AsyncSession, user_id: int, deck: Deck, updates: dict):
+        """Apply absolute {card_id: learned} values in one upsert; cards outside the deck are ignored.
+
+        Returns the number of progress rows that changed.
+        """
+        new = func.unnest(
+            literal(list(updates), ARRAY(Integer)),
+            literal(list(updates.values()), ARRAY(Boolean))
+        ).table_valued("card_id", "learned").render_derived()
+        # no row already means not learned, so false values only touch existing rows
+        stmt = insert(UserProgress).from_select(
+            ["user_id", "deck_id", "card_id", "learned"],
+            select(literal(user_id), literal(deck.id), Card.id, new.c.learned).select_from(new).join(
+                Card, and_(Card.id == new.c.card_id, Card.deck_id == deck.id)
+            ).outerjoin(UserProgress, and_(
+                UserProgress.card_id == Card.id,
+                UserProgress.user_id == user_id
+            )).where(or_(new.c.learned, UserProgress.id.isnot(None)))
+        )
+        # rows already holding the value are left alone, so retries are no-ops and return nothing
+        changed = (await db.execute(stmt.on_conflict_do_update(
+            index_elements=[UserProgress.user_id, UserProgress.card_id],
+            set_={"learned": stmt.excluded.learned},
+            where=UserProgress.learned.is_distinct_from(stmt.excluded.learned)
+        ).returning(UserProgress.learned))).scalars().all()
+        # every returned row flipped, so the counter moves by the difference instead of a recount
+        delta = sum(1 if learned else -1 for learned in changed)
+        if delta:
+            await DeckService._add_learned(db, user_id, deck.id, delta)
+        await db.commit()
+        return len(changed)
+
+    @staticmethod
+    async def _add_learned(db: AsyncSession, user_id: int, deck_id: int, delta: int):
+        stmt = insert(DeckProgress).values(user_id=user_id, deck_id=deck_id, learned=max(delta, 0))
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[DeckProgress.user_id, DeckProgress.deck_id],
+            set_={"learned": DeckProgress.learned + delta}
+        ))
+
+    @staticmethod
+    def _sm2(interval_days: int, ease: float, repetitions: int, grade: int):
+        """SM-2 step for a 0-5 answer grade; returns the new (interval_days, ease, repetitions)"""
+        if grade >= 3:
+            if repetitions == 0:
+                interval_days = 1
+            elif repetitions == 1:
+                interval_days = 6
+            else:
+                interval_days = round(interval_days * ease)
+            repetitions += 1
+        else:
+            interval_days, repetitions = 1, 0
+        ease = max(1.3, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+        return interval_days, ease, repetitions
+
+    @staticmethod
+    async def review_cards(db: AsyncSession, user_id: int, deck: Deck, grades: dict):
+        """Reschedule the graded {card_id: grade} cards with one read and one upsert.
+
+        Cards outside the deck are ignored; returns the new schedule of the reviewed cards.
+        """
+        current = (await db.execute(select(
+            Card.id, UserProgress.interval_days, UserProgress.ease, UserProgress.repetitions
+        ).outerjoin(UserProgress, and_(
+            UserProgress.card_id == Card.id,
+            UserProgress.user_id == user_id
+        )).where(Card.deck_id == deck.id, Card.id.in_(list(grades))))).all()
+        if not current:
+            return []
+        now = datetime.now(timezone.utc)
+        schedule = [(row.id, *DeckService._sm2(
+            row.interval_days or 0, row.ease or 2.5, row.repetitions or 0, grades[row.id]
+        )) for row in current]
+        card_ids, intervals, eases, repetitions = zip(*schedule)
+        new = func.unnest(
+            literal(list(card_ids), ARRAY(Integer)),
+            literal(list(intervals), ARRAY(Integer)),
+            literal(list(eases), ARRAY(Float)),
+            literal(list(repetitions), ARRAY(Integer)),
+            literal([now + timedelta(days=days) for days in intervals], ARRAY(DateTime(timezone=True)))
+        ).table_valued("card_id", "interval_days", "ease", "repetitions", "due_at").render_derived()
+        stmt = insert(UserProgress).from_select(
+            ["user_id", "deck_id", "card_id", "learned", "interval_days", "ease", "repetitions", "due_at"],
+            select(
+                literal(user_id), literal(deck.id), new.c.card_id, literal(False),
+                new.c.interval_days, new.c.ease, new.c.repetitions, new.c.due_at
+            )
+        )
+        rows = (await db.execute(stmt.on_conflict_do_update(
+            index_elements=[UserProgress.user_id, UserProgress.card_id],
+            set_={column: stmt.excluded[column] for column in ("interval_days", "ease", "repetitions", "due_at")}
+        ).returning(UserProgress.card_id, UserProgress.interval_days, UserProgress.due_at))).all()
+        await db.commit()
+        return [{"card_id": row.card_id, "interval_days": row.interval_days, "due_at": row.due_at} for row in rows]
 
     @staticmethod
-    def get_statistics(db: Session, user_id: int, deck: Deck):
-        total = db.query(Card).filter(Card.deck_id == deck.id).count()
+    async def get_statistics(db: AsyncSession, user_id: int, deck: Deck):
         if user_id is not None:
-            learned = db.query(UserProgress).filter(
+            learned = select(DeckProgress.learned).where(
+                DeckProgress.user_id == user_id,
+                DeckProgress.deck_id == deck.id
+            ).scalar_subquery()
+            # index-only range count on ix_user_progress_due, plus the new cards a due session would take on
+            scheduled = select(func.count()).select_from(UserProgress).where(
                 UserProgress.user_id == user_id,
                 UserProgress.deck_id == deck.id,
-                UserProgress.learned
-            ).count()
+                UserProgress.due_at <= func.now()
+            ).scalar_subquery()
+            unscheduled = select(func.count()).select_from(
+                DeckService._new_cards_statement(deck, user_id).subquery()
+            ).scalar_subquery()
+            row = (await db.execute(
+                select(func.coalesce(learned, 0).label("learned"), (scheduled + unscheduled).label("due"))
+            )).one()
+            learned, due = row.learned, row.due
         else:
-            learned = 0
+            learned = due = 0
         return {
-            "total": total,
-            "learned": learned
+            "total": deck.card_count,
+            "learned": learned,
+            "due": due
         }
 
     @staticmethod
-    def reset_progress(db: Session, user_id: int, deck: Deck):
-        db.query(UserProgress).filter(
+    async def rebuild_counters(db: AsyncSession, deck_id: int = None):
+        """Recompute decks.card_count and deck_progress from cards/user_progress
+        for one deck, or for every deck when deck_id is None"""
+        card_count = select(func.count(Card.id)).where(Card.deck_id == Deck.id).scalar_subquery()
+        decks = update(Deck).values(card_count=card_count)
+        learned = select(
+            UserProgress.user_id, UserProgress.deck_id, func.count(UserProgress.id)
+        ).where(
+            UserProgress.learned.is_(True),
+            UserProgress.user_id.isnot(None)
+        ).group_by(UserProgress.user_id, UserProgress.deck_id)
+        stale = update(DeckProgress).values(learned=0)
+        if deck_id is not None:
+            decks = decks.where(Deck.id == deck_id)
+            learned = learned.where(UserProgress.deck_id == deck_id)
+            stale = stale.where(DeckProgress.deck_id == deck_id)
+        await db.execute(decks.execution_options(synchronize_session=False))
+        await db.execute(stale.execution_options(synchronize_session=False))
+        stmt = insert(DeckProgress).from_select(["user_id", "deck_id", "learned"], learned)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[DeckProgress.user_id, DeckProgress.deck_id],
+            set_={"learned": stmt.excluded.learned}
+        ))
+
+    @staticmethod
+    async def check_counters(db: AsyncSession):
+        """Return the decks and (user, deck) pairs whose stored counters drifted"""
+        actual_cards = select(func.count(Card.id)).where(Card.deck_id == Deck.id).scalar_subquery()
+        decks = (await db.execute(
+            select(Deck.id, Deck.card_count, actual_cards.label("actual")).where(Deck.card_count != actual_cards)
+        )).all()
+        actual_learned = select(
+            UserProgress.user_id, UserProgress.deck_id, func.count(UserProgress.id).label("learned")
+        ).where(
+            UserProgress.learned.is_(True),
+            UserProgress.user_id.isnot(None)
+        ).group_by(UserProgress.user_id, UserProgress.deck_id).subquery()
+        progress = (await db.execute(
+            select(
+                func.coalesce(DeckProgress.user_id, actual_learned.c.user_id).label("user_id"),
+                func.coalesce(DeckProgress.deck_id, actual_learned.c.deck_id).label("deck_id"),
+                func.coalesce(DeckProgress.learned, 0).label("learned"),
+                func.coalesce(actual_learned.c.learned, 0).label("actual")
+            ).select_from(DeckProgress.__table__.join(
+                actual_learned,
+                and_(DeckProgress.user_id == actual_learned.c.user_id,
+                     DeckProgress.deck_id == actual_learned.c.deck_id),
+                full=True
+            )).where(func.coalesce(DeckProgress.learned, 0) != func.coalesce(actual_learned.c.learned, 0))
+        )).all()
+        return decks, progress
+
+    @staticmethod
+    async def reset_progress(db: AsyncSession, user_id: int, deck: Deck):
+        await db.execute(delete(UserProgress).where(
             UserProgress.user_id == user_id,
             UserProgress.deck_id == deck.id
-        ).delete()
-        db.commit()
+        ))
+        await db.execute(delete(DeckProgress).where(
+            DeckProgress.user_id == user_id,
+            DeckProgress.deck_id == deck.id
+        ))
+        await db.commit()
         return True
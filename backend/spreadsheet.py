@@ -0,0 +1,152 @@
+"""Spreadsheet import/export.
+
+openpyxl is imported inside the functions that need it, so API workers only pay for it
+on the first xlsx import or export rather than at startup.
+"""
+import csv
+import io
+import json
+import re
+import tempfile
+from typing import BinaryIO, Iterator, Sequence, Tuple, Union
+
+
+IMPORT_EXTENSIONS = (".xlsx", ".csv", ".tsv")
+EXPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+CHUNK_SIZE = 64 * 1024
+
+
+class _Upload(io.RawIOBase):
+    """Readable, seekable view of an upload. Before Python 3.11 SpooledTemporaryFile lacks
+    readable()/seekable(), which TextIOWrapper and zipfile need; closing the view leaves the
+    upload open for its owner."""
+
+    def __init__(self, file: BinaryIO):
+        self._upload = file
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._upload.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._upload.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._upload.tell()
+
+
+def _rows(file: BinaryIO, filename: str) -> Iterator[tuple]:
+    file = io.BufferedReader(_Upload(file), CHUNK_SIZE)
+    if filename.endswith(".xlsx"):
+        from openpyxl import load_workbook
+        # read-only mode parses the sheet lazily instead of building it in memory
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        yield from csv.reader(text, delimiter="\t" if filename.endswith(".tsv") else ",")
+
+
+def _cell(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _cards(rows: Iterator[tuple], entry_index: int, value_index: int) -> Iterator[Tuple[str, str]]:
+    width = max(entry_index, value_index) + 1
+    for row in rows:
+        if len(row) < width:
+            continue
+        entry, value = _cell(row[entry_index]), _cell(row[value_index])
+        if entry and value:
+            yield entry, value
+
+
+def read_cards(file: BinaryIO, filename: str) -> Union[str, Iterator[Tuple[str, str]]]:
+    """Stream (entry, value) pairs out of an xlsx/csv/tsv upload.
+
+    The header row is read eagerly; if it lacks the entry/value columns the localization
+    key of the error is returned instead of the iterator.
+    """
+    rows = _rows(file, filename)
+    header = [_cell(column).lower() for column in next(rows, ())]
+    if "entry" not in header or "value" not in header:
+        rows.close()
+        return "error.excel_columns"
+    return _cards(rows, header.index("entry"), header.index("value"))
+
+
+class CsvWriter:
+    def header(self) -> bytes:
+        # the BOM makes Excel read the file as UTF-8, read_cards strips it again
+        return "\ufeffentry,value\r\n".encode("utf-8")
+
+    def write(self, rows: Sequence[Tuple[str, str]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def finish(self) -> Iterator[bytes]:
+        return iter(())
+
+
+class NdjsonWriter:
+    def header(self) -> bytes:
+        return b""
+
+    def write(self, rows: Sequence[Tuple[str, str]]) -> bytes:
+        return "".join(
+            json.dumps({"entry": entry, "value": value}, ensure_ascii=False) + "\n" for entry, value in rows
+        ).encode("utf-8")
+
+    def finish(self) -> Iterator[bytes]:
+        return iter(())
+
+
+class XlsxWriter:
+    """xlsx is a zip archive, so nothing can be sent before the last row is in. Write-only mode
+    spools rows to disk and the archive is assembled in a temporary file, keeping memory flat."""
+
+    def __init__(self, title: str):
+        from openpyxl import Workbook
+        self.workbook = Workbook(write_only=True)
+        # sheet titles are limited to 31 characters without []:*?/\
+        self.sheet = self.workbook.create_sheet(re.sub(r"[\[\]:*?/\\]", "", title)[:31] or "cards")
+
+    def header(self) -> bytes:
+        self.sheet.append(["entry", "value"])
+        return b""
+
+    def write(self, rows: Sequence[Tuple[str, str]]) -> bytes:
+        for row in rows:
+            # write-only sheets only take plain sequences, not database rows
+            self.sheet.append(tuple(row))
+        return b""
+
+    def finish(self) -> Iterator[bytes]:
+        with tempfile.TemporaryFile() as output:
+            self.workbook.save(output)
+            output.seek(0)
+            while chunk := output.read(CHUNK_SIZE):
+                yield chunk
+
+
+def writer(export_format: str, title: str):
+    if export_format == "xlsx":
+        return XlsxWriter(title)
+    if export_format == "ndjson":
+        return NdjsonWriter()
+    return CsvWriter()
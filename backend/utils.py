@@ -1,5 +1,5 @@
 from typing import Optional, Dict, Any
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
 
 
 class APIException(HTTPException):
@@ -12,3 +12,13 @@ class APIException(HTTPException):
         self.localization_key = localization_key
         self.details = details or {}
         super().__init__(status_code=status_code, detail=None)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check; the weak comparison RFC 9110 prescribes for conditional GETs"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
@@ -0,0 +1,26 @@
+import api from "./axios";
+
+// a page of a listing: its items and the cursor of the next page, null on the last one
+export const headerCursorPage = response => ({
+    items: response?.data || [],
+    next: response?.headers?.["x-next-cursor"] ?? null,
+});
+
+export const bodyCursorPage = (field) => response => ({
+    items: response?.data?.[field] || [],
+    next: response?.data?.next_cursor ?? null,
+});
+
+// follows the cursor of a paged listing until the last page and returns all of its items;
+// `readPage` picks them out of a response, the deck listing's cursor travels in X-Next-Cursor
+export async function fetchAllPages(url, params = {}, readPage = headerCursorPage) {
+    const items = [];
+    let after = null;
+    do {
+        const response = await api.get(url, { params: { ...params, after: after ?? undefined } });
+        const page = readPage(response);
+        items.push(...page.items);
+        after = page.next;
+    } while (after !== null);
+    return items;
+}
@@ -16,7 +16,6 @@ function Cards() {
   const location = useLocation();
   const { deck_id, mode, deck_name } = location.state || {};
   const [cardData, setCardData] = useState({ entry: '', value: '', id: 0, 'learned': false });
-  const [seenCards, setSeenCards] = useState(new Set());
   const [answer, setAnswer] = useState('');
   const encodedValue = useEncoder(cardData.value);
   const [stats, setStats] = useState({ learned: 0, total: 0, remain: 0 });
@@ -29,9 +28,11 @@ function Cards() {
   const [showResetModal, setShowResetModal] = useState(false);
   const [showRestartModal, setShowRestartModal] = useState(false);
   const [showNoLearnedModal, setShowNoLearnedModal] = useState(false);
+  const [error, setError] = useState("");
   const navigate = useNavigate();
   const { t } = useTranslation();
   const mountedRef = useRef(false);
+  const sessionRef = useRef(null);
   const { ref } = useScramble({
     text: showTranslation ? cardData.value : encodedValue,
     speed: 1,
@@ -40,16 +41,21 @@ function Cards() {
     overdrive: false,
   });
 
-  const fetchCard = async (excludeIds = null) => {
+  const fetchCard = async (restart = false) => {
     setLoading(true);
     try {
+      if (restart || !sessionRef.current) {
+        const session = await api.post(`/api/decks/${deck_id}/sessions`, { mode: mode });
+        sessionRef.current = session.data.session;
+      }
       const response = await api.post(`/api/decks/${deck_id}/next-card`, {
-        mode: mode,
-        exclude: excludeIds || Array.from(seenCards)
+        session: sessionRef.current
       })
+      if (response?.data?.session) {
+        sessionRef.current = response.data.session;
+      }
       if (response?.data?.card?.id) {
         setCardData(response?.data?.card);
-        setSeenCards(prev => new Set([...prev, response.data.card.id]));
       } else if (response?.data?.card === null) {
         if (mode === "learned" && stats.learned === 0) {
           setShowNoLearnedModal(true);
@@ -65,6 +71,13 @@ function Cards() {
       setValueShown(false);
       setShowTranslation(false);
     } catch (err) {
+      if (!restart && err.response?.data?.localization_key === "error.session_not_found") {
+        // the session expired or was purged, so the token is dead: carry on in a new session
+        sessionRef.current = null;
+        setError(t(err.response.data.localization_key));
+        await fetchCard(true);
+        return;
+      }
       console.error("Failed to fetch card");
     } finally {
       setLoading(false);
@@ -99,6 +112,21 @@ function Cards() {
     }
   }
 
+  const handleNext = async () => {
+    if (isAuthenticated && mode === "due" && cardData.id) {
+      try {
+        // SM-2 grade: typed the right answer or had to look it up
+        await api.post(`/api/decks/${deck_id}/reviews`, {
+          reviews: [{ card_id: cardData.id, grade: solved ? 4 : 1 }]
+        });
+      } catch (err) {
+        console.error("Failed to save review");
+      }
+    }
+    setError('');
+    await fetchCard();
+  }
+
   const handleCardClick = () => {
     !valueShown && setShowTranslation(!showTranslation);
     setValueShown(true);
@@ -122,8 +150,7 @@ function Cards() {
 
   const handleModalRestart = async () => {
     try {
-      setSeenCards(new Set());
-      await fetchCard([]);
+      await fetchCard(true);
     } catch (err) {
       console.error("Failed to restart");
     } finally {
@@ -136,8 +163,7 @@ function Cards() {
     setLoading(true);
     try {
       await api.delete(`/api/decks/${deck_id}/reset`);
-      setSeenCards(new Set());
-      await fetchCard([]);
+      await fetchCard(true);
     } catch (err) {
       console.error("Failed to reset progress");
     } finally {
@@ -244,6 +270,7 @@ function Cards() {
                 {t('check')}</button>
             </div>
           </div>
+          {error && <div className="error">{error}</div>}
         </div>
         <div className='page-bottom'>
           <div className='buttons'>
@@ -259,7 +286,7 @@ function Cards() {
             }
             <button
               className={`button-big ${isAuthenticated ? '' : 'button-single'}`}
-              onClick={() => fetchCard()}
+              onClick={handleNext}
               disabled={loading}
             >
               {t('next')}
@@ -4,6 +4,7 @@ import { ProtectedRoute } from '../components/ProtectedRoute';
 import { useTranslation } from 'react-i18next';
 import CustomScrollComponent from '../components/CustomScrollComponent';
 import api from "../api/axios";
+import { fetchAllPages, bodyCursorPage } from "../api/pagination";
 
 
 function EditCards() {
@@ -25,16 +26,16 @@ function EditCards() {
 
     const fetchCards = async () => {
         try {
-            const response = await api.get(`/api/decks/${deck_id}/cards`);
-            if (response?.data?.cards) {
-                const cardsData = response.data.cards;
-                const formattedCards = cardsData.map(card => ({
-                    id: crypto.randomUUID(),
-                    entry: card.entry,
-                    value: card.value,
-                }));
-                setFormData({ cards: formattedCards });
-            }
+            // the editor saves the whole deck, so walk every page
+            const cardsData = await fetchAllPages(
+                `/api/decks/${deck_id}/cards`, { limit: 5000 }, bodyCursorPage("cards")
+            );
+            const formattedCards = cardsData.map(card => ({
+                id: crypto.randomUUID(),
+                entry: card.entry,
+                value: card.value,
+            }));
+            setFormData({ cards: formattedCards });
         } catch (err) {
             console.error("Failed to fetch cards");
         }
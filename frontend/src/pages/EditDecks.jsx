@@ -5,6 +5,7 @@ import { CustomDropdown } from "../components/CustomDropdown";
 import { useTranslation } from 'react-i18next';
 import { ConfirmModal } from '../components/ConfirmModal';
 import api from "../api/axios";
+import { fetchAllPages } from "../api/pagination";
 
 
 function EditDecks() {
@@ -19,8 +20,7 @@ function EditDecks() {
 
   const fetchDecks = async () => {
     try {
-      const response = await api.get("/api/decks");
-      const decksData = response.data;
+      const decksData = await fetchAllPages("/api/decks", { limit: 1000 });
       const formattedDecks = decksData.map(deck => ({
         value: deck.id.toString(),
         label: deck.name
@@ -69,7 +69,7 @@ function EditDecks() {
   const handleFileSelect = async (event) => {
     const file = event.target.files[0];
     if (!file) return;
-    if (!file.name.endsWith('.xlsx') && !file.name.endsWith('.xls')) {
+    if (!['.xlsx', '.csv', '.tsv'].some((ext) => file.name.endsWith(ext))) {
       setError(t('error.only_excel'));
       return;
     }
@@ -197,7 +197,7 @@ function EditDecks() {
               type="file"
               ref={fileInputRef}
               onChange={handleFileSelect}
-              accept=".xlsx,.xls"
+              accept=".xlsx,.csv,.tsv"
               style={{ display: 'none' }}
             />
             <button
@@ -1,7 +1,7 @@
 import { useState, useEffect } from 'react'
 import { useNavigate } from "react-router-dom";
 import { CustomDropdown } from "../components/CustomDropdown";
-import api from "../api/axios";
+import { fetchAllPages } from "../api/pagination";
 import { useTranslation } from 'react-i18next';
 import { useAuth } from "../components/AuthContext";
 
@@ -17,8 +17,7 @@ function Menu() {
   useEffect(() => {
     const fetchDecks = async () => {
       try {
-        const response = await api.get("/api/decks?show_all=1");
-        const decksData = response.data;
+        const decksData = await fetchAllPages("/api/decks", { show_all: 1, limit: 1000 });
         const formattedDecks = decksData.map(deck => ({
           value: deck.id,
           label: deck.name
@@ -37,6 +36,7 @@ function Menu() {
     { value: 'unlearned', label: t('unlearned') },
     { value: 'all', label: t('all') },
     { value: 'learned', label: t('learned') },
+    { value: 'due', label: t('due') },
   ] : [
     { value: 'all', label: t('all') },
   ]